@@ -1,148 +1,408 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import JWTManager
-from flask_cors import CORS  
-from flask_bcrypt import Bcrypt
 from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from cachetools import TLRUCache, TTLCache
 import os
+import hashlib
+import hmac
 import logging
+import secrets
+import threading
+import time
+import bcrypt as bcrypt_lib
+import orjson
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits import parse_many
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Configure logging more explicitly
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Bcrypt
-bcrypt = Bcrypt(app)
+# bcrypt cost factor for user passwords (2^rounds key-schedule iterations).
+# Each step doubles hashing time, so calibrate BCRYPT_ROUNDS to the host's CPU;
+# existing hashes are only upgraded on login, never downgraded.
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+if not 4 <= PASSWORD_BCRYPT_ROUNDS <= 31:
+    raise RuntimeError("BCRYPT_ROUNDS must be between 4 and 31.")
+if PASSWORD_BCRYPT_ROUNDS < 10:
+    # Fine for tests and local development, where hashing speed matters more
+    logger.warning("BCRYPT_ROUNDS is %d; use at least 12 in production.", PASSWORD_BCRYPT_ROUNDS)
+
+# bcrypt processes per Gunicorn worker. Every worker has its own pool, so the
+# default splits the host's cores between WEB_CONCURRENCY workers (the same
+# default gunicorn.conf.py uses) instead of giving each worker all of them.
+_CPUS = os.cpu_count() or 1
+BCRYPT_POOL_WORKERS = int(os.getenv(
+    "BCRYPT_POOL_WORKERS",
+    max(1, _CPUS // int(os.getenv("WEB_CONCURRENCY", _CPUS))),
+))
+
+# How long, and for how many logins, a successful password check is
+# remembered so a client logging in again soon after skips bcrypt. Kept small:
+# see the trade-off described on Bcrypt.
+PASSWORD_CHECK_CACHE_TTL = 30
+PASSWORD_CHECK_CACHE_SIZE = 256
+
+class Bcrypt:
+    """Thin wrapper around the native ``bcrypt`` bindings.
+
+    Keeps the Flask-Bcrypt method names so existing callers don't change,
+    but calls ``hashpw``/``checkpw`` directly instead of going through the
+    extension's config lookups on every hash. The hashing itself runs in a
+    process pool so CPU-bound bcrypt work is spread across cores.
+
+    Under gevent workers the pool's processes are forked from a patched
+    process; gevent's fork reinitialises the hub in each child, and the
+    children only ever run ``hashpw``/``checkpw``. Waiting on a result
+    yields to other greenlets rather than blocking the worker. (The pool is
+    not started with "spawn": that re-imports ``__main__`` in every child,
+    which breaks the pool for scripts without a main guard.)
+
+    Successful checks are remembered for a short while under an HMAC of the
+    stored hash and the password, keyed with a random per-process pepper.
+    Failed checks always run bcrypt. This is a trade-off: the pepper lives in
+    the same process, so anyone able to dump this worker's memory gets both,
+    and can brute-force the passwords behind the cached entries at
+    HMAC-SHA256 speed rather than bcrypt speed. The cache is kept to the
+    last few hundred logins of the last PASSWORD_CHECK_CACHE_TTL seconds to
+    bound that exposure.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = PASSWORD_BCRYPT_ROUNDS
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._dummy_hash = None
+        self._pepper = secrets.token_bytes(32)
+        self._checked = TTLCache(maxsize=PASSWORD_CHECK_CACHE_SIZE, ttl=PASSWORD_CHECK_CACHE_TTL)
+        self._checked_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.get("BCRYPT_LOG_ROUNDS", self.rounds)
+        app.extensions["bcrypt"] = self
+
+    def _executor(self):
+        # Created lazily (and per PID) so each Gunicorn worker gets its own
+        # pool after fork rather than inheriting the master's
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=BCRYPT_POOL_WORKERS)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def generate_password_hash(self, password, rounds=None):
+        """Hash a password, returning the bcrypt hash as bytes."""
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+        salt = bcrypt_lib.gensalt(rounds or self.rounds)
+        return self._executor().submit(bcrypt_lib.hashpw, password, salt).result()
+
+    @property
+    def dummy_hash(self):
+        """Hash of a random password, for checking logins against unknown users.
+
+        Running the same check as for a real user keeps response times from
+        revealing which usernames exist.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self.generate_password_hash(secrets.token_hex(16))
+        return self._dummy_hash
+
+    def needs_rehash(self, pw_hash):
+        """Return True if ``pw_hash`` was made with fewer rounds than we use now."""
+        if isinstance(pw_hash, bytes):
+            pw_hash = pw_hash.decode("utf-8")
+        try:
+            # bcrypt hashes look like $2b$<rounds>$<salt+digest>
+            return int(pw_hash.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return True
 
-# Allow requests from frontend with credentials support
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+    def check_password_hash(self, pw_hash, password):
+        """Check a password against a stored bcrypt hash."""
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode("utf-8")
+        if isinstance(password, str):
+            password = password.encode("utf-8")
+
+        # The stored hash is part of the key, so changing a password leaves
+        # nothing behind that could match the old one
+        check_key = hmac.new(self._pepper, pw_hash + b"\0" + password, hashlib.sha256).digest()
+        with self._checked_lock:
+            if check_key in self._checked:
+                return True
+
+        matches = self._executor().submit(bcrypt_lib.checkpw, password, pw_hash).result()
+        if matches:
+            with self._checked_lock:
+                self._checked[check_key] = True
+        return matches
 
 # Comprehensive JWT Configuration
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "supersecret")
 if not JWT_SECRET_KEY:
-    logging.error("JWT_SECRET_KEY is missing! Authentication is not secure.")
+    logger.error("JWT_SECRET_KEY is missing! Authentication is not secure.")
     raise RuntimeError("JWT_SECRET_KEY must be set in environment variables.")
 
-# Extensive JWT Configuration
-app.config.update(
-    JWT_SECRET_KEY=JWT_SECRET_KEY,
-    JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=24),
-    JWT_TOKEN_LOCATION=["headers"],
-    JWT_HEADER_NAME="Authorization",
-    JWT_HEADER_TYPE="Bearer",
-    PROPAGATE_EXCEPTIONS=True,
-    
-    # Debug configurations
-    JWT_ERROR_MESSAGE_KEY="msg",  # Helps with error message consistency
-)
+class CachingJWTManager(JWTManager):
+    """JWTManager that memoizes verified token payloads.
+
+    A client reusing the same bearer token skips the signature check and
+    claim validation on repeat requests. Each entry lives for ``ttl``
+    seconds or until the token's ``exp``, whichever comes first, so an
+    expired token is never served from the cache; it falls through to the
+    normal decode and raises as before. Entries are keyed on a SHA-256
+    digest, so raw bearer tokens aren't kept in memory.
+    """
+
+    def __init__(self, app=None, maxsize=4096, ttl=60):
+        # Wall-clock timer, since exp is a Unix timestamp
+        self._decoded_tokens = TLRUCache(
+            maxsize=maxsize,
+            ttu=lambda _key, decoded, now: min(decoded.get("exp", now + ttl), now + ttl),
+            timer=time.time,
+        )
+        self._decoded_tokens_lock = threading.Lock()
+        super().__init__(app)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        token_key = hashlib.sha256(encoded_token.encode("utf-8")).digest()
+        with self._decoded_tokens_lock:
+            decoded = self._decoded_tokens.get(token_key)
+
+        if decoded is not None and decoded.get("nbf", 0) <= time.time():
+            return dict(decoded)
+
+        try:
+            decoded = super()._decode_jwt_from_config(encoded_token)
+        except Exception:
+            with self._decoded_tokens_lock:
+                self._decoded_tokens.pop(token_key, None)
+            raise
+
+        with self._decoded_tokens_lock:
+            self._decoded_tokens[token_key] = decoded
+        return dict(decoded)
+
+# Extensions are created unbound here and attached to the app in create_app(),
+# so blueprints can import them without importing an app instance
+bcrypt = Bcrypt()
 
 # Initialize JWT Manager with additional error handling
-jwt = JWTManager(app)
+jwt = CachingJWTManager()
 
 # Enhanced JWT error handlers with improved logging
 @jwt.invalid_token_loader
 def handle_invalid_token(error_message):
-    logging.error(f"Invalid token error: {error_message}")
+    logger.error("Invalid token error: %s", error_message)
     return {"msg": "Invalid token"}, 422
 
 @jwt.unauthorized_loader
 def handle_unauthorized_request(error_message):
-    logging.error(f"Unauthorized request: {error_message}")
+    logger.error("Unauthorized request: %s", error_message)
     return {"msg": "Missing or invalid Authorization header"}, 401
 
 @jwt.expired_token_loader
 def handle_expired_token(jwt_header, jwt_payload):
-    logging.error(f"Expired token. Header: {jwt_header}, Payload: {jwt_payload}")
+    logger.error("Expired token. Header: %s, Payload: %s", jwt_header, jwt_payload)
     return {"msg": "Token has expired"}, 401
 
 @jwt.needs_fresh_token_loader
 def handle_needs_fresh_token():
-    logging.error("Fresh token required")
+    logger.error("Fresh token required")
     return {"msg": "Fresh token required"}, 401
 
 @jwt.revoked_token_loader
 def handle_revoked_token(jwt_header, jwt_payload):
-    logging.error(f"Revoked token. Header: {jwt_header}, Payload: {jwt_payload}")
+    logger.error("Revoked token. Header: %s, Payload: %s", jwt_header, jwt_payload)
     return {"msg": "Token has been revoked"}, 401
 
-# Custom function to get the client's real IP address from behind proxies
-def get_real_ip():
-    """Get the real IP address, accounting for proxies and load balancers."""
-    # Check X-Forwarded-For header (common for proxies)
-    x_forwarded_for = request.headers.get('X-Forwarded-For')
-    if x_forwarded_for:
-        # Get the first address in the chain (client's original IP)
-        ip = x_forwarded_for.split(',')[0].strip()
-        logging.debug(f"Using X-Forwarded-For IP: {ip}")
-        return ip
-    
-    # Check X-Real-IP header (used by some reverse proxies)
-    x_real_ip = request.headers.get('X-Real-IP')
-    if x_real_ip:
-        logging.debug(f"Using X-Real-IP: {x_real_ip}")
-        return x_real_ip
-    
-    # Fall back to the remote address
-    logging.debug(f"Using remote address: {request.remote_addr}")
-    return request.remote_addr
-
-# Make sure get_real_ip is available for import in other modules
-__all__ = ['app', 'bcrypt', 'limiter', 'get_real_ip', 'jwt']
-
-# Add authentication logging middleware
-@app.before_request
+# Request logging for debugging authentication and rate limiting issues
 def log_request_info():
-    # Log important information for debugging authentication issues
+    # Runs before every request, so it stays silent (and skips building the
+    # header dumps) unless DEBUG is on
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("Request: %s %s from %s", request.method, request.path, request.remote_addr)
     auth_header = request.headers.get('Authorization', None)
     masked_auth = f"{auth_header[:15]}..." if auth_header and len(auth_header) > 15 else auth_header
-    logging.info(f"Request: {request.method} {request.path}")
-    logging.debug(f"Auth header: {masked_auth}")
-    logging.debug(f"Request IP: {get_real_ip()}")
+    logger.debug("Auth header: %s", masked_auth)
+    logger.debug("Headers: %s", request.headers)
+
+# CORS for the API. Origins are unrestricted, but the caller's origin is echoed
+# back (rather than "*") so credentialed requests are still accepted.
+CORS_ALLOW_METHODS = "GET, POST, PUT, DELETE, OPTIONS"
+CORS_ALLOW_HEADERS = "Authorization, Content-Type"
+CORS_MAX_AGE = "600"  # Let browsers reuse a preflight for 10 minutes
+
+def handle_cors_preflight():
+    # Answer preflights before routing, rate limiting or JWT checks run
+    if request.method == "OPTIONS" and request.path.startswith("/api/"):
+        return "", 204
 
-# Before request logging to debug rate limiting
-@app.before_request
-def debug_request():
-    client_ip = get_real_ip()
-    logging.info(f"Request: {request.method} {request.path} from {client_ip}")
-    logging.debug(f"Headers: {request.headers}")
+def add_cors_headers(response):
+    origin = request.headers.get("Origin")
+    if origin and request.path.startswith("/api/"):
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        response.vary.add("Origin")
+        if request.method == "OPTIONS":
+            response.headers["Access-Control-Allow-Methods"] = CORS_ALLOW_METHODS
+            response.headers["Access-Control-Allow-Headers"] = CORS_ALLOW_HEADERS
+            response.headers["Access-Control-Max-Age"] = CORS_MAX_AGE
+    return response
+
+# Shared rate limit storage so counters are consistent across Gunicorn workers.
+# Falls back to per-process memory when no Redis instance is configured.
+RATELIMIT_STORAGE_URI = os.getenv("REDIS_URL", "memory://")
+RATELIMIT_STRATEGY = os.getenv("RATELIMIT_STRATEGY", "fixed-window")
+DEFAULT_RATE_LIMITS = ["200 per day", "50 per hour"]
+
+# Moving-window limits cost O(limit) per hit, so large ones stall the storage
+MAX_MOVING_WINDOW_LIMIT = 1000
+
+def check_rate_limit_strategy(strategy, limit_strings):
+    """Refuse to start with moving-window limits above MAX_MOVING_WINDOW_LIMIT."""
+    if strategy != "moving-window":
+        return
+    for limit_string in limit_strings:
+        for item in parse_many(limit_string):
+            if item.amount > MAX_MOVING_WINDOW_LIMIT:
+                raise RuntimeError(
+                    f"Rate limit '{limit_string}' is too large for the moving-window strategy; "
+                    "use fixed-window instead."
+                )
+
+check_rate_limit_strategy(RATELIMIT_STRATEGY, DEFAULT_RATE_LIMITS)
 
 # Initialize rate limiter with custom key function
 limiter = Limiter(
-    app=app,  # Pass app directly here
-    key_func=get_real_ip,  # Use our custom function
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
-    strategy="fixed-window",
+    key_func=get_remote_address,  # Correct behind proxies thanks to ProxyFix
+    default_limits=DEFAULT_RATE_LIMITS,
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy=RATELIMIT_STRATEGY,  # fixed-window: one INCR+EXPIRE script call per hit on Redis
     headers_enabled=True,  # Enable rate limit headers in responses
 )
 
+def _json_default(obj):
+    # Types orjson doesn't handle natively; Decimal matches jsonify's str() output
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, so ``jsonify`` and
+    ``request.get_json`` skip the stdlib encoder and decoder.
+
+    Keeps the default provider's key sorting and its fallbacks for types orjson
+    doesn't handle (such as Decimal). Dates and datetimes are written as ISO 8601
+    instead of HTTP dates.
+    """
+
+    def _encode(self, obj):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson already produces UTF-8 bytes, so hand them over as the body
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+def json_response(obj, status=200):
+    """Serialize ``obj`` with orjson into a JSON response.
+
+    Faster drop-in for ``jsonify`` on large payloads such as chart data.
+    ``bytes`` are taken as already-serialized JSON and sent as is.
+    """
+    body = obj if isinstance(obj, bytes) else orjson.dumps(obj, default=_json_default)
+    return Response(body, status=status, mimetype="application/json")
+
 # Add rate limit exceeded handler
-@app.errorhandler(429)
 def ratelimit_handler(e):
-    logging.warning(f"Rate limit exceeded: {e.description}")
+    logger.warning("Rate limit exceeded: %s", e.description)
     return jsonify({
         "error": "Too many requests",
         "message": "Rate limit exceeded. Please try again later."
     }), 429
 
-# Fixed: Update the rate limit headers function to use the current Flask-Limiter API
-@app.after_request
-def inject_rate_limit_headers(response):
-    try:
-        # Check if the current request was rate limited
-        current_limit = getattr(request, '_view_rate_limit', None)
-        if current_limit:
-            window_stats = getattr(current_limit, 'get_window_stats', None)
-            if window_stats and callable(window_stats):
-                stats = window_stats()
-                response.headers.add('X-RateLimit-Remaining', str(stats.remaining))
-                response.headers.add('X-RateLimit-Limit', str(stats.limit))
-                response.headers.add('X-RateLimit-Reset', str(stats.reset))
-    except Exception as e:
-        logging.error(f"Error injecting rate limit headers: {e}")
-    
-    return response
\ No newline at end of file
+# (module, blueprint attribute, url prefix) for every blueprint the app serves
+BLUEPRINTS = (
+    ("charts", "charts_bp", "/api"),
+    ("apple_music", "apple_music_bp", "/api"),
+    ("auth", "auth_bp", "/api/auth"),
+    ("favourites", "favourites_bp", "/api"),
+    ("admin", "admin_bp", "/api/admin"),
+    ("predictions", "predictions_bp", "/api"),
+)
+
+def create_app():
+    """Create the Flask app, bind the shared extensions and register blueprints."""
+    # The one place logging is configured; modules only call getLogger(__name__).
+    # LOG_LEVEL=DEBUG turns on the request and query tracing, which is skipped
+    # entirely at the default INFO.
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+
+    # Trust the X-Forwarded-* headers set by the hosting proxy so request.remote_addr
+    # is the client's address. PROXY_FIX_X_FOR is the number of proxies in front.
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app,
+        x_for=int(os.getenv("PROXY_FIX_X_FOR", "1")),
+        x_proto=1,
+    )
+
+    # Extensive JWT Configuration
+    app.config.update(
+        JWT_SECRET_KEY=JWT_SECRET_KEY,
+        JWT_ACCESS_TOKEN_EXPIRES=timedelta(hours=24),
+        JWT_TOKEN_LOCATION=["headers"],
+        JWT_HEADER_NAME="Authorization",
+        JWT_HEADER_TYPE="Bearer",
+        PROPAGATE_EXCEPTIONS=True,
+
+        # Debug configurations
+        JWT_ERROR_MESSAGE_KEY="msg",  # Helps with error message consistency
+    )
+
+    bcrypt.init_app(app)
+
+    # Allow requests from frontend with credentials support. Registered before
+    # the limiter so preflights don't count against anyone's rate limit.
+    app.before_request(handle_cors_preflight)
+    app.after_request(add_cors_headers)
+
+    jwt.init_app(app)
+    limiter.init_app(app)
+
+    app.before_request(log_request_info)
+    app.register_error_handler(429, ratelimit_handler)
+
+    # Imported here because the blueprint modules import the extensions above
+    for module_name, blueprint_name, url_prefix in BLUEPRINTS:
+        blueprint = getattr(import_module(module_name), blueprint_name)
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
+
+    return app
+
+__all__ = ['create_app', 'bcrypt', 'limiter', 'jwt', 'json_response']
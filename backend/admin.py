@@ -1,10 +1,9 @@
 from flask import Blueprint, jsonify, request
-from __init__ import limiter, get_real_ip
+from __init__ import limiter
 import os
+import hmac
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 admin_bp = Blueprint("admin", __name__)
@@ -20,27 +19,29 @@ def reset_rate_limiter():
     auth_header = request.headers.get("X-Admin-Key")
     
     # Log attempt with IP address for security
-    client_ip = get_real_ip()
-    logger.info(f"Rate limiter reset attempt from IP: {client_ip}")
+    client_ip = request.remote_addr
+    logger.info("Rate limiter reset attempt from IP: %s", client_ip)
     
     if not ADMIN_SECRET_KEY:
         logger.error("ADMIN_SECRET_KEY not set in environment variables")
         return jsonify({"error": "Server misconfiguration: Admin key not set"}), 500
     
-    if not auth_header or auth_header != ADMIN_SECRET_KEY:
-        logger.warning(f"Unauthorized rate limiter reset attempt from {client_ip}")
+    # Constant-time comparison so response timing doesn't reveal how much of
+    # the key matched
+    if not auth_header or not hmac.compare_digest(auth_header.encode("utf-8"), ADMIN_SECRET_KEY.encode("utf-8")):
+        logger.warning("Unauthorized rate limiter reset attempt from %s", client_ip)
         return jsonify({"error": "Unauthorized"}), 401
     
     try:
         # Reset the limiter
         limiter.reset()
-        logger.info(f"Rate limiter reset successfully by {client_ip}")
+        logger.info("Rate limiter reset successfully by %s", client_ip)
         return jsonify({
             "success": True, 
             "message": "Rate limiter reset successfully"
         }), 200
     except Exception as e:
-        logger.error(f"Error resetting rate limiter: {e}")
+        logger.error("Error resetting rate limiter: %s", e)
         return jsonify({
             "success": False, 
             "error": str(e)
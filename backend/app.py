@@ -1,34 +1,18 @@
-from __init__ import app, bcrypt, limiter
+from __init__ import create_app, limiter
 from flask import jsonify, request
-from charts import charts_bp
-from apple_music import apple_music_bp
-from auth import auth_bp
-from favourites import favourites_bp
-from admin import admin_bp
-from predictions import predictions_bp  # Use relative import
 import logging
+import os
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Register blueprints
-app.register_blueprint(charts_bp, url_prefix="/api")
-app.register_blueprint(apple_music_bp, url_prefix="/api")
-app.register_blueprint(auth_bp, url_prefix="/api/auth")
-app.register_blueprint(favourites_bp, url_prefix="/api")
-app.register_blueprint(admin_bp, url_prefix="/api/admin")
-app.register_blueprint(predictions_bp, url_prefix="/api")  # Register the new blueprint
+app = create_app()
 
-# Rest of your existing code...
-
-# Add this to app.py after registering blueprints
 @app.route("/api/test-limiter", methods=["GET"])
 @limiter.limit("3 per minute")
 def test_rate_limit():
     # Log the request details for debugging
-    client_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    logger.info(f"Rate limit test accessed by: {client_ip}")
+    client_ip = request.remote_addr
+    logger.info("Rate limit test accessed by: %s", client_ip)
     
     # Include the client IP in the response for troubleshooting
     return jsonify({
@@ -50,5 +34,7 @@ def debug_headers():
         "all_headers": headers
     })
 
-if __name__ == "__main__":
+# The Werkzeug server is for local development only; production runs under
+# Gunicorn (gunicorn.conf.py)
+if __name__ == "__main__" and os.getenv("DEV"):
     app.run(host="0.0.0.0", port=5001)
\ No newline at end of file
@@ -2,6 +2,9 @@ from flask import Blueprint, jsonify
 import os
 import jwt
 import time
+import logging
+import threading
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 # Create a Blueprint for Apple Music
 apple_music_bp = Blueprint("apple_music", __name__)
@@ -11,38 +14,85 @@ TEAM_ID = os.getenv("APPLE_MUSIC_TEAM_ID")
 KEY_ID = os.getenv("APPLE_MUSIC_KEY_ID")
 PRIVATE_KEY_PATH = "/etc/secrets/AuthKey.p8"  # Using Render Secret Files
 
-def generate_apple_music_token():
-    """Generates a JWT token for Apple Music API authentication."""
-    if not os.path.exists(PRIVATE_KEY_PATH):
-        return jsonify({"error": "Private key file missing"}), 500
+logger = logging.getLogger(__name__)
 
+def load_private_key():
+    """Reads and parses the ES256 signing key, or returns None if it's unavailable."""
+    if not os.path.exists(PRIVATE_KEY_PATH):
+        return None
     try:
-        with open(PRIVATE_KEY_PATH, "r") as key_file:
-            private_key = key_file.read()
+        with open(PRIVATE_KEY_PATH, "rb") as key_file:
+            return load_pem_private_key(key_file.read(), password=None)
+    except Exception as e:
+        logger.error("Failed to load Apple Music private key: %s", e)
+        return None
+
+# Parsed once at import; PyJWT signs with the key object directly instead of
+# re-reading and re-parsing the PEM for every token
+PRIVATE_KEY = load_private_key()
+TOKEN_HEADERS = {"kid": KEY_ID}
+
+# Tokens are valid for 180 days, so sign one per worker and hand it out until
+# it is within a day of expiring instead of re-signing on every request
+TOKEN_TTL = 180 * 24 * 60 * 60
+TOKEN_REFRESH_MARGIN = 24 * 60 * 60
+_cached_token = None
+_cached_exp = 0
+_token_lock = threading.Lock()
 
+def get_cached_apple_music_token():
+    """Returns a cached token, generating a new one when it is close to expiry."""
+    global _cached_token, _cached_exp
+    with _token_lock:
+        if _cached_token is None or time.time() > _cached_exp - TOKEN_REFRESH_MARGIN:
+            # Pick the expiry here and have it signed as is, so the cache
+            # expires with exactly the exp the token carries
+            expires_at = int(time.time()) + TOKEN_TTL
+            token = generate_apple_music_token(expires_at)
+            # Errors come back as (message, status) and are never cached
+            if isinstance(token, tuple):
+                return token
+            _cached_token = token
+            _cached_exp = expires_at
+        return _cached_token
+
+def generate_apple_music_token(expires_at=None):
+    """Generates a JWT token for Apple Music API authentication.
+
+    ``expires_at`` is the token's ``exp`` as a Unix timestamp; it defaults
+    to TOKEN_TTL (180 days) from now. Returns the token string, or an
+    ``(error message, status)`` tuple.
+    """
+    if PRIVATE_KEY is None:
+        return "Private key file missing", 500
+
+    try:
         # Token payload
+        if expires_at is None:
+            expires_at = int(time.time()) + TOKEN_TTL
         payload = {
             "iss": TEAM_ID,
-            "exp": int(time.time()) + (180 * 24 * 60 * 60),  # 180-day expiry
-            "iat": int(time.time()),
+            "exp": expires_at,
+            "iat": expires_at - TOKEN_TTL,
         }
 
         # Generate JWT Token
         token = jwt.encode(
-            payload, private_key, algorithm="ES256", headers={"kid": KEY_ID}
+            payload, PRIVATE_KEY, algorithm="ES256", headers=TOKEN_HEADERS
         )
 
         return token
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return str(e), 500
 
 @apple_music_bp.route("/apple-music-token", methods=["GET"])
 def get_apple_music_token():
     """Returns the Apple Music API token."""
-    token = generate_apple_music_token()
+    token = get_cached_apple_music_token()
 
-    # If token is a response object (error), return it directly
-    if isinstance(token, tuple):  
-        return token  # Avoids wrapping an error response inside jsonify
+    # Errors come back as (message, status); only the route builds responses
+    if isinstance(token, tuple):
+        message, status = token
+        return jsonify({"error": message}), status
 
     return jsonify({"token": token})
\ No newline at end of file
@@ -1,5 +1,6 @@
-from flask import Blueprint, request, jsonify, g, current_app
-from __init__ import limiter, bcrypt, get_real_ip
+from flask import Blueprint, Response, request, jsonify, g, current_app
+from __init__ import limiter, bcrypt, json_response
+from db import db_connection, db_cursor, execute_prepared
 from flask_jwt_extended import (
     create_access_token, 
     get_jwt_identity, 
@@ -7,12 +8,18 @@ from flask_jwt_extended import (
     create_refresh_token
 )
 import psycopg2
+from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
+from cachetools import TTLCache
 import os
 import logging
-import uuid
+import hashlib
+import threading
 import jwt as pyjwt
 import secrets
+import random
+import time
+import orjson
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -20,8 +27,6 @@ from datetime import datetime, timedelta
 
 auth_bp = Blueprint("auth", __name__)
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Define a token expiration time (1 hour)
@@ -35,24 +40,73 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 SENDER_EMAIL = os.getenv("SENDER_EMAIL", SMTP_USERNAME)
 APP_URL = os.getenv("APP_URL", "https://www.waveger.com")
 
-def get_db_connection():
-    try:
-        return psycopg2.connect(DATABASE_URL)
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Unique indexes on users (see migrations/004), used to tell which field a
+# duplicate-key error was about
+USERNAME_UNIQUE_CONSTRAINT = "users_username_key"
+EMAIL_UNIQUE_CONSTRAINT = "users_email_key"
+
+# Serialized /user bodies and their ETags, keyed on user ID. Only this worker's
+# writes invalidate entries, so the TTL bounds how stale points from the
+# prediction processor or other workers can be.
+USER_CACHE_TTL = 30
+_user_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL)
+# Serialized /user-info bodies, keyed on username. Unknown usernames aren't
+# cached, so a later registration never has a stale "not found" to clear.
+_user_info_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL)
+_user_cache_lock = threading.Lock()
+
+# Columns behind /user and /user-info, named and ordered as the API returns
+# them; read with a RealDictCursor so each row is already the user dict, and
+# orjson writes the timestamps as ISO 8601 itself.
+# migrations/005 covers the lookup by id with an index holding all of them.
+USER_PROFILE_COLUMNS = (
+    "id, username, email, created_at, last_login, "
+    "COALESCE(total_points, 0) AS total_points, "
+    "COALESCE(weekly_points, 0) AS weekly_points, "
+    "COALESCE(predictions_made, 0) AS predictions_made, "
+    "COALESCE(correct_predictions, 0) AS correct_predictions"
+)
+
+def cache_user_profile(user):
+    """Serialize a RealDictCursor row of USER_PROFILE_COLUMNS as a /user body and cache it.
+
+    Returns ``(body, etag)``. Writes that already have the fresh row (via
+    RETURNING) call this so the client's next /user is a cache hit.
+    """
+    body = orjson.dumps(user)
+    etag = hashlib.sha1(body).hexdigest()
+    with _user_cache_lock:
+        _user_cache[user["id"]] = (body, etag)
+    return body, etag
+
+def invalidate_user_cache(user_id, username):
+    """Drop a user's cached /user and /user-info responses after their row changes."""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+        _user_info_cache.pop(username, None)
+
+def _user_data_response(body, etag):
+    # Clients revalidating an unchanged body get a 304 without it being resent
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = json_response(body)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 def generate_unique_token_id():
     """Generate a unique identifier for tokens."""
-    return str(uuid.uuid4())
+    # 128 random bits, URL-safe base64: 22 characters against a UUID's 36
+    return secrets.token_urlsafe(16)
 
 @auth_bp.route("/register", methods=["POST"])
-@limiter.limit("20 per hour", key_func=get_real_ip)
+@limiter.limit("20 per hour")
 def register():
     try:
         data = request.get_json()
-        logger.info(f"Registration request from IP: {get_real_ip()}")
-        logger.info(f"Received registration request: {data}")
+        # Never log the request body; it carries the plaintext password
+        logger.info("Registration request from IP: %s", request.remote_addr)
         
         username = data.get("username")
         email = data.get("email")
@@ -64,79 +118,81 @@ def register():
 
         password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        try:
-            logger.info("Attempting to insert new user")
-            cursor.execute(
-                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id",
-                (username, email, password_hash)
-            )
-            user_id = cursor.fetchone()[0]
-            conn.commit()
-            logger.info(f"Successfully registered user {username}")
+            try:
+                logger.debug("Attempting to insert new user")
+                cursor.execute(
+                    "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) "
+                    "RETURNING " + USER_PROFILE_COLUMNS,
+                    (username, email, password_hash)
+                )
+                new_user = cursor.fetchone()
+                user_id = new_user["id"]
+                conn.commit()
+                cache_user_profile(new_user)
+                logger.info("Successfully registered user %s", username)
 
-            # Generate tokens with additional metadata
-            additional_claims = {
-                "username": username,
-                "email": email,
-                "token_id": generate_unique_token_id()
-            }
+                # Generate tokens with additional metadata
+                additional_claims = {
+                    "username": username,
+                    "email": email,
+                    "token_id": generate_unique_token_id()
+                }
             
-            access_token = create_access_token(
-                identity=str(user_id),  # Ensure identity is a string
-                additional_claims=additional_claims,
-                expires_delta=timedelta(hours=24)
-            )
+                access_token = create_access_token(
+                    identity=str(user_id),  # Ensure identity is a string
+                    additional_claims=additional_claims,
+                    expires_delta=timedelta(hours=24)
+                )
             
-            refresh_token = create_refresh_token(
-                identity=str(user_id),
-                additional_claims=additional_claims,
-                expires_delta=timedelta(days=30)
-            )
+                refresh_token = create_refresh_token(
+                    identity=str(user_id),
+                    additional_claims=additional_claims,
+                    expires_delta=timedelta(days=30)
+                )
             
-            response = jsonify({
-                "message": "Registration successful",
-                "access_token": access_token,
-                "refresh_token": refresh_token,
-                "user": {
-                    "id": user_id,
-                    "username": username,
-                    "email": email
-                }
-            })
-            
-            response.headers.add('Access-Control-Allow-Credentials', 'true')
-            return response, 201
-
-        except psycopg2.IntegrityError as e:
-            conn.rollback()
-            logger.error(f"Database integrity error: {e}")
-            if "username" in str(e):
-                return jsonify({"error": "Username already taken"}), 409
-            if "email" in str(e):
-                return jsonify({"error": "Email already registered"}), 409
-            return jsonify({"error": "Registration failed"}), 400
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Unexpected database error: {e}")
-            return jsonify({"error": "Registration failed"}), 500
-        finally:
-            cursor.close()
-            conn.close()
+                response = jsonify({
+                    "message": "Registration successful",
+                    "access_token": access_token,
+                    "refresh_token": refresh_token,
+                    "user": {
+                        "id": user_id,
+                        "username": username,
+                        "email": email
+                    }
+                })
+            
+                response.headers.add('Access-Control-Allow-Credentials', 'true')
+                return response, 201
+
+            except psycopg2.IntegrityError as e:
+                conn.rollback()
+                logger.error("Database integrity error: %s", e)
+                if e.diag.constraint_name == USERNAME_UNIQUE_CONSTRAINT:
+                    return jsonify({"error": "Username already taken"}), 409
+                if e.diag.constraint_name == EMAIL_UNIQUE_CONSTRAINT:
+                    return jsonify({"error": "Email already registered"}), 409
+                return jsonify({"error": "Registration failed"}), 400
+            except Exception as e:
+                conn.rollback()
+                logger.error("Unexpected database error: %s", e)
+                return jsonify({"error": "Registration failed"}), 500
+            finally:
+                cursor.close()
 
     except Exception as e:
-        logger.error(f"General registration error: {e}")
+        logger.error("General registration error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @auth_bp.route("/login", methods=["POST"])
-@limiter.limit("5 per minute", key_func=get_real_ip)
+@limiter.limit("5 per minute")
 def login():
     try:
         data = request.get_json()
         # Log client IP for debugging
-        logger.info(f"Login request from IP: {get_real_ip()}")
+        logger.info("Login request from IP: %s", request.remote_addr)
         
         username = data.get("username")
         password = data.get("password")
@@ -144,136 +200,141 @@ def login():
         if not all([username, password]):
             return jsonify({"error": "All fields are required"}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        try:
-            cursor.execute(
+        with db_cursor() as cursor:
+            execute_prepared(
+                cursor, "login_user",
                 "SELECT id, username, email, password_hash FROM users WHERE username = %s",
                 (username,)
             )
             user = cursor.fetchone()
 
-            if user and bcrypt.check_password_hash(user[3], password):
-                # Generate tokens with additional metadata
-                additional_claims = {
-                    "username": user[1],
-                    "email": user[2],
-                    "token_id": generate_unique_token_id()
-                }
-                
-                access_token = create_access_token(
-                    identity=str(user[0]),  # Ensure identity is a string
-                    additional_claims=additional_claims,
-                    expires_delta=timedelta(hours=24)
-                )
-                
-                refresh_token = create_refresh_token(
-                    identity=str(user[0]),
-                    additional_claims=additional_claims,
-                    expires_delta=timedelta(days=30)
-                )
-
-                # Update last login
-                cursor.execute(
-                    "UPDATE users SET last_login = %s WHERE id = %s",
-                    (datetime.utcnow(), user[0])
+        # bcrypt runs with no pooled connection held; it takes far longer than the queries.
+        # Always pay for one check so unknown usernames aren't distinguishable by
+        # how quickly they fail.
+        password_ok = bcrypt.check_password_hash(user[3] if user else bcrypt.dummy_hash, password)
+
+        if not (user and password_ok):
+            # A little jitter on top blurs what timing differences remain
+            time.sleep(random.uniform(0, 0.02))
+            return jsonify({"error": "Invalid credentials"}), 401
+
+        # Upgrade hashes made at an older cost while we have the plaintext
+        new_password_hash = None
+        if bcrypt.needs_rehash(user[3]):
+            new_password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+
+        # Generate tokens with additional metadata
+        additional_claims = {
+            "username": user[1],
+            "email": user[2],
+            "token_id": generate_unique_token_id()
+        }
+    
+        access_token = create_access_token(
+            identity=str(user[0]),  # Ensure identity is a string
+            additional_claims=additional_claims,
+            expires_delta=timedelta(hours=24)
+        )
+    
+        refresh_token = create_refresh_token(
+            identity=str(user[0]),
+            additional_claims=additional_claims,
+            expires_delta=timedelta(days=30)
+        )
+
+        with db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            try:
+                # Update last login, and the password hash if it was upgraded,
+                # in a single statement. The timestamp is taken server-side, as
+                # naive UTC like the values datetime.utcnow() used to send.
+                # The fresh row comes back too, ready for the client's next /user.
+                # The upgraded hash is only written over the hash that was just
+                # checked, so a password reset committed in the meantime wins.
+                execute_prepared(
+                    cursor, "login_touch_user",
+                    "UPDATE users SET last_login = now() AT TIME ZONE 'UTC', "
+                    "password_hash = CASE WHEN password_hash = %s "
+                    "THEN COALESCE(%s, password_hash) ELSE password_hash END "
+                    "WHERE id = %s "
+                    "RETURNING " + USER_PROFILE_COLUMNS,
+                    (user[3], new_password_hash, user[0])
                 )
+                profile = cursor.fetchone()
                 conn.commit()
-
-                response = jsonify({
-                    "access_token": access_token,
-                    "refresh_token": refresh_token,
-                    "user": {
-                        "id": user[0],
-                        "username": user[1],
-                        "email": user[2]
-                    }
-                })
-                
-                response.headers.add('Access-Control-Allow-Credentials', 'true')
-                return response, 200
-            else:
-                return jsonify({"error": "Invalid credentials"}), 401
-
-        finally:
-            cursor.close()
-            conn.close()
+            finally:
+                cursor.close()
+        invalidate_user_cache(user[0], user[1])
+        cache_user_profile(profile)
+
+        response = jsonify({
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "user": {
+                "id": user[0],
+                "username": user[1],
+                "email": user[2]
+            }
+        })
+    
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response, 200
 
     except Exception as e:
-        logger.error(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         return jsonify({"error": "Login failed"}), 500
 
 @auth_bp.route("/user", methods=["GET"])
 @jwt_required()
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_user_data():
     try:
         # Get the user ID from the JWT token
         user_id = get_jwt_identity()
-        logger.debug(f"Extracted user ID from token: {user_id}")
+        logger.debug("Extracted user ID from token: %s", user_id)
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with _user_cache_lock:
+            cached = _user_cache.get(int(user_id))
+        if cached is not None:
+            return _user_data_response(*cached)
 
-        try:
-            # Comprehensive query logging
-            logger.debug("Executing user data query")
-            query = """
-                SELECT 
-                    id, username, email, 
-                    created_at, last_login, 
-                    total_points, weekly_points, 
-                    predictions_made, correct_predictions 
-                FROM users 
-                WHERE id = %s
-            """
-            logger.debug(f"Query: {query}")
-            logger.debug(f"Query parameters: {user_id}")
-
-            # Ensure user_id is converted to an integer
-            cursor.execute(query, (int(user_id),))
-            
-            # Fetch the user
-            user = cursor.fetchone()
-            logger.debug(f"Query result: {user}")
-
-            if not user:
-                logger.error(f"No user found with ID: {user_id}")
-                return jsonify({"error": "User not found"}), 404
-
-            # Detailed field conversion and logging
-            user_data = {
-                "id": int(user[0]) if user[0] is not None else None,
-                "username": str(user[1]) if user[1] is not None else None,
-                "email": str(user[2]) if user[2] is not None else None,
-                "created_at": user[3].isoformat() if user[3] is not None else None,
-                "last_login": user[4].isoformat() if user[4] is not None else None,
-                "total_points": int(user[5]) if user[5] is not None else 0,
-                "weekly_points": int(user[6]) if user[6] is not None else 0,
-                "predictions_made": int(user[7]) if user[7] is not None else 0,
-                "correct_predictions": int(user[8]) if user[8] is not None else 0
-            }
+        with db_cursor(RealDictCursor) as cursor:
+            try:
+                # Comprehensive query logging
+                logger.debug("Executing user data query")
+                query = "SELECT " + USER_PROFILE_COLUMNS + " FROM users WHERE id = %s"
+                logger.debug("Query: %s", query)
+                logger.debug("Query parameters: %s", user_id)
 
-            # Log each field for verification
-            for key, value in user_data.items():
-                logger.debug(f"User field {key}: {value} (type: {type(value)})")
+                # Ensure user_id is converted to an integer
+                execute_prepared(cursor, "user_profile_by_id", query, (int(user_id),))
+            
+                # Fetch the user
+                user = cursor.fetchone()
+                logger.debug("Query result: %s", user)
 
-            return jsonify(user_data), 200
+                if not user:
+                    logger.error("No user found with ID: %s", user_id)
+                    return jsonify({"error": "User not found"}), 404
 
-        except Exception as e:
-            logger.error(f"Error processing user data: {e}")
-            return jsonify({"error": "Failed to process user data", "details": str(e)}), 500
-        finally:
-            cursor.close()
-            conn.close()
+                # Log each field for verification, only when DEBUG is on
+                if logger.isEnabledFor(logging.DEBUG):
+                    for key, value in user.items():
+                        logger.debug("User field %s: %s (type: %s)", key, value, type(value))
+
+                return _user_data_response(*cache_user_profile(user))
+
+            except Exception as e:
+                logger.error("Error processing user data: %s", e)
+                return jsonify({"error": "Failed to process user data", "details": str(e)}), 500
 
     except Exception as e:
-        logger.error(f"Unexpected error in get_user_data: {e}")
+        logger.error("Unexpected error in get_user_data: %s", e)
         return jsonify({"error": "Unexpected server error", "details": str(e)}), 500
 
 @auth_bp.route("/check-availability", methods=["GET"])
-@limiter.limit("20 per minute", key_func=get_real_ip)
+@limiter.limit("20 per minute")
 def check_availability():
     """
     Check if a username or email is already in use.
@@ -288,39 +349,32 @@ def check_availability():
     if not username and not email:
         return jsonify({"error": "Please provide username or email to check"}), 400
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    try:
-        result = {}
-
-        # Check username availability
-        if username:
-            cursor.execute(
-                "SELECT EXISTS(SELECT 1 FROM users WHERE username = %s)",
-                (username,)
+    with db_cursor() as cursor:
+        try:
+            # Both flags in one round trip; a missing parameter is passed as
+            # NULL, which matches nothing, and its flag is left out below
+            execute_prepared(
+                cursor, "user_availability",
+                "SELECT EXISTS(SELECT 1 FROM users WHERE username = %s), "
+                "EXISTS(SELECT 1 FROM users WHERE email = %s)",
+                (username, email)
             )
-            result['username_exists'] = cursor.fetchone()[0]
+            username_exists, email_exists = cursor.fetchone()
 
-        # Check email availability
-        if email:
-            cursor.execute(
-                "SELECT EXISTS(SELECT 1 FROM users WHERE email = %s)",
-                (email,)
-            )
-            result['email_exists'] = cursor.fetchone()[0]
+            result = {}
+            if username:
+                result['username_exists'] = username_exists
+            if email:
+                result['email_exists'] = email_exists
 
-        return jsonify(result), 200
+            return jsonify(result), 200
 
-    except Exception as e:
-        logger.error(f"Availability check error: {e}")
-        return jsonify({"error": "Error checking availability"}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except Exception as e:
+            logger.error("Availability check error: %s", e)
+            return jsonify({"error": "Error checking availability"}), 500
 
 @auth_bp.route("/refresh", methods=["POST"])
-@limiter.limit("10 per minute", key_func=get_real_ip)
+@limiter.limit("10 per minute")
 def refresh():
     try:
         data = request.get_json()
@@ -341,47 +395,34 @@ def refresh():
             
         # Verify the refresh token using PyJWT directly
         try:
-            # First, decode without verification to get the token_id
-            unverified_payload = pyjwt.decode(
-                refresh_token, 
-                options={"verify_signature": False}
-            )
-            token_id = unverified_payload.get("token_id")
-            
-            # Now properly decode and verify
             decoded_token = pyjwt.decode(
                 refresh_token,
                 jwt_secret_key,
                 algorithms=["HS256"]
             )
             
-            # Extract user information
+            # Extract the token ID and user information
+            token_id = decoded_token.get("token_id")
             user_id = decoded_token.get('sub')
             if not user_id:
                 logger.error("Missing user ID in token")
                 raise ValueError("Missing user ID in token")
                 
             # Connect to DB to get user details
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "SELECT username, email FROM users WHERE id = %s",
-                (int(user_id),)
-            )
+            with db_cursor() as cursor:
+                execute_prepared(
+                    cursor, "refresh_user",
+                    "SELECT username, email FROM users WHERE id = %s",
+                    (int(user_id),)
+                )
             
-            db_user = cursor.fetchone()
-            if not db_user:
-                cursor.close()
-                conn.close()
-                logger.error(f"User not found with ID: {user_id}")
-                raise ValueError("User not found")
+                db_user = cursor.fetchone()
+                if not db_user:
+                    logger.error("User not found with ID: %s", user_id)
+                    raise ValueError("User not found")
                 
-            username = db_user[0]
-            email = db_user[1]
-            
-            cursor.close()
-            conn.close()
+                username = db_user[0]
+                email = db_user[1]
             
             # Generate a new access token
             access_token = create_access_token(
@@ -404,11 +445,11 @@ def refresh():
             }), 200
             
         except Exception as e:
-            logger.error(f"Token validation error: {e}")
+            logger.error("Token validation error: %s", e)
             return jsonify({"error": "Invalid refresh token"}), 401
             
     except Exception as e:
-        logger.error(f"Token refresh error: {e}")
+        logger.error("Token refresh error: %s", e)
         return jsonify({"error": "Failed to refresh token"}), 500
 
 def send_password_reset_email(email, token):
@@ -466,14 +507,14 @@ def send_password_reset_email(email, token):
         server.sendmail(SENDER_EMAIL, email, message.as_string())
         server.quit()
         
-        logger.info(f"Password reset email sent to {email}")
+        logger.info("Password reset email sent to %s", email)
         return True
     except Exception as e:
-        logger.error(f"Failed to send password reset email: {e}")
+        logger.error("Failed to send password reset email: %s", e)
         return False
 
 @auth_bp.route("/forgot-password", methods=["POST"])
-@limiter.limit("5 per hour", key_func=get_real_ip)
+@limiter.limit("5 per hour")
 def forgot_password():
     """Handles forgot password requests by sending a reset email."""
     try:
@@ -484,67 +525,65 @@ def forgot_password():
             return jsonify({"error": "Email address is required"}), 400
             
         # Log the request for monitoring
-        client_ip = get_real_ip()
-        logger.info(f"Password reset requested for {email} from IP: {client_ip}")
+        client_ip = request.remote_addr
+        logger.info("Password reset requested for %s from IP: %s", email, client_ip)
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # Check if email exists
-            cursor.execute("SELECT id, username FROM users WHERE email = %s", (email,))
-            user = cursor.fetchone()
-            
-            if not user:
-                # For security reasons, still return success even if email is not found
-                # This prevents user enumeration
-                logger.info(f"Password reset requested for non-existent email: {email}")
-                return jsonify({"message": "If your email is registered, you will receive reset instructions"}), 200
+            try:
+                # Check if email exists
+                cursor.execute("SELECT id, username FROM users WHERE email = %s", (email,))
+                user = cursor.fetchone()
+            
+                if not user:
+                    # For security reasons, still return success even if email is not found
+                    # This prevents user enumeration
+                    logger.info("Password reset requested for non-existent email: %s", email)
+                    return jsonify({"message": "If your email is registered, you will receive reset instructions"}), 200
                 
-            user_id, username = user
+                user_id, username = user
                 
-            # Generate a secure random token
-            reset_token = secrets.token_urlsafe(32)
-            token_expiry = datetime.utcnow() + RESET_TOKEN_EXPIRY
+                # Generate a secure random token
+                reset_token = secrets.token_urlsafe(32)
             
-            # Store the reset token
-            cursor.execute(
-                """
-                INSERT INTO password_reset_tokens (user_id, token, expiry, used)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (user_id, reset_token, token_expiry, False)
-            )
-            conn.commit()
+                # Store the reset token; expiry is computed server-side in naive UTC
+                cursor.execute(
+                    """
+                    INSERT INTO password_reset_tokens (user_id, token, expiry, used)
+                    VALUES (%s, %s, (now() AT TIME ZONE 'UTC') + %s, %s)
+                    """,
+                    (user_id, reset_token, RESET_TOKEN_EXPIRY, False)
+                )
+                conn.commit()
             
-            # Send the reset email
-            email_sent = send_password_reset_email(email, reset_token)
+                # Send the reset email
+                email_sent = send_password_reset_email(email, reset_token)
             
-            if not email_sent:
-                # If email fails, still allow alternative reset methods
-                logger.error(f"Failed to send password reset email to {email}")
-                return jsonify({
-                    "message": "Password reset initiated but email could not be sent. Please contact support."
-                }), 202
+                if not email_sent:
+                    # If email fails, still allow alternative reset methods
+                    logger.error("Failed to send password reset email to %s", email)
+                    return jsonify({
+                        "message": "Password reset initiated but email could not be sent. Please contact support."
+                    }), 202
                 
-            return jsonify({
-                "message": "Password reset instructions have been sent to your email"
-            }), 200
+                return jsonify({
+                    "message": "Password reset instructions have been sent to your email"
+                }), 200
             
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error during password reset: {e}")
-            return jsonify({"error": "Failed to process password reset request"}), 500
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Database error during password reset: %s", e)
+                return jsonify({"error": "Failed to process password reset request"}), 500
+            finally:
+                cursor.close()
             
     except Exception as e:
-        logger.error(f"Unexpected error in forgot_password: {e}")
+        logger.error("Unexpected error in forgot_password: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 @auth_bp.route("/verify-reset-token", methods=["GET"])
-@limiter.limit("20 per hour", key_func=get_real_ip)
+@limiter.limit("20 per hour")
 def verify_reset_token():
     """Verifies if a password reset token is valid."""
     try:
@@ -553,10 +592,7 @@ def verify_reset_token():
         if not token:
             return jsonify({"error": "Token is required"}), 400
             
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with db_cursor() as cursor:
             # Check if the token exists and is valid
             cursor.execute(
                 """
@@ -568,36 +604,32 @@ def verify_reset_token():
                 (token,)
             )
             token_data = cursor.fetchone()
-            
+
             if not token_data:
                 return jsonify({"valid": False, "error": "Invalid or expired token"}), 401
-                
-            token_id, user_id, expiry, used, username, email = token_data
             
+            token_id, user_id, expiry, used, username, email = token_data
+
             # Check if token is expired
             if expiry < datetime.utcnow():
                 return jsonify({"valid": False, "error": "Token has expired"}), 401
-                
+            
             # Check if token has been used
             if used:
                 return jsonify({"valid": False, "error": "Token has already been used"}), 401
-                
+            
             return jsonify({
                 "valid": True, 
                 "username": username,
                 "email": email
             }), 200
-            
-        finally:
-            cursor.close()
-            conn.close()
-            
+
     except Exception as e:
-        logger.error(f"Error verifying reset token: {e}")
+        logger.error("Error verifying reset token: %s", e)
         return jsonify({"error": "Failed to verify token"}), 500
 
 @auth_bp.route("/reset-password", methods=["POST"])
-@limiter.limit("5 per hour", key_func=get_real_ip)
+@limiter.limit("5 per hour")
 def reset_password():
     """Resets a user's password using a valid reset token."""
     try:
@@ -611,76 +643,75 @@ def reset_password():
         if len(new_password) < 8:
             return jsonify({"error": "Password must be at least 8 characters long"}), 400
             
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Hash the new password before taking a connection and the token's row
+        # lock, so neither is held for the duration of the bcrypt work
+        password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
+            
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        try:
-            # Begin transaction
-            # Check if the token exists and is valid
-            cursor.execute(
-                """
-                SELECT t.id, t.user_id, t.expiry, t.used, u.username
-                FROM password_reset_tokens t
-                JOIN users u ON t.user_id = u.id
-                WHERE t.token = %s
-                FOR UPDATE
-                """,
-                (token,)
-            )
-            token_data = cursor.fetchone()
+            try:
+                # Begin transaction
+                # Check if the token exists and is valid
+                cursor.execute(
+                    """
+                    SELECT t.id, t.user_id, t.expiry, t.used, u.username
+                    FROM password_reset_tokens t
+                    JOIN users u ON t.user_id = u.id
+                    WHERE t.token = %s
+                    FOR UPDATE
+                    """,
+                    (token,)
+                )
+                token_data = cursor.fetchone()
             
-            if not token_data:
-                return jsonify({"error": "Invalid or expired token"}), 401
+                if not token_data:
+                    return jsonify({"error": "Invalid or expired token"}), 401
                 
-            token_id, user_id, expiry, used, username = token_data
+                token_id, user_id, expiry, used, username = token_data
             
-            # Check if token is expired
-            if expiry < datetime.utcnow():
-                return jsonify({"error": "Token has expired"}), 401
+                # Check if token is expired
+                if expiry < datetime.utcnow():
+                    return jsonify({"error": "Token has expired"}), 401
                 
-            # Check if token has been used
-            if used:
-                return jsonify({"error": "Token has already been used"}), 401
+                # Check if token has been used
+                if used:
+                    return jsonify({"error": "Token has already been used"}), 401
                 
-            # Hash the new password
-            password_hash = bcrypt.generate_password_hash(new_password).decode('utf-8')
-            
-            # Update the user's password
-            cursor.execute(
-                "UPDATE users SET password_hash = %s WHERE id = %s",
-                (password_hash, user_id)
-            )
-            
-            # Mark the token as used
-            cursor.execute(
-                "UPDATE password_reset_tokens SET used = %s WHERE id = %s",
-                (True, token_id)
-            )
+                # Update the user's password and mark the token as used in one round trip
+                cursor.execute(
+                    """
+                    WITH used_token AS (
+                        UPDATE password_reset_tokens SET used = TRUE WHERE id = %s
+                    )
+                    UPDATE users SET password_hash = %s WHERE id = %s
+                    """,
+                    (token_id, password_hash, user_id)
+                )
             
-            # Commit the transaction
-            conn.commit()
+                # Commit the transaction
+                conn.commit()
             
-            # Log the successful password reset
-            logger.info(f"Password reset successful for user {username}")
+                # Log the successful password reset
+                logger.info("Password reset successful for user %s", username)
             
-            return jsonify({
-                "message": "Password has been reset successfully. You can now log in with your new password."
-            }), 200
+                return jsonify({
+                    "message": "Password has been reset successfully. You can now log in with your new password."
+                }), 200
             
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error during password reset: {e}")
-            return jsonify({"error": "Failed to reset password"}), 500
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Database error during password reset: %s", e)
+                return jsonify({"error": "Failed to reset password"}), 500
+            finally:
+                cursor.close()
             
     except Exception as e:
-        logger.error(f"Unexpected error in reset_password: {e}")
+        logger.error("Unexpected error in reset_password: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 @auth_bp.route("/user-info", methods=["GET"])
-@limiter.limit("20 per minute", key_func=get_real_ip)
+@limiter.limit("20 per minute")
 def get_user_info():
     """
     Get basic user information by username (without requiring authentication).
@@ -692,65 +723,47 @@ def get_user_info():
         if not username:
             return jsonify({"error": "Username is required"}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with _user_cache_lock:
+            cached = _user_info_cache.get(username)
+        if cached is not None:
+            return json_response(cached), 200
         
-        try:
-            # Query to fetch only necessary user info, excluding sensitive data like password
-            query = """
-                SELECT 
-                    id, username, email, 
-                    created_at, last_login, 
-                    total_points, weekly_points, 
-                    predictions_made, correct_predictions 
-                FROM users 
-                WHERE username = %s
-            """
-            logger.debug(f"Fetching user info for username: {username}")
-            
-            cursor.execute(query, (username,))
-            user = cursor.fetchone()
-            
-            if not user:
-                # For security reasons, don't indicate whether the user exists or not
-                # Just return a generic success response with empty data
-                return jsonify({
+        with db_cursor(RealDictCursor) as cursor:
+            try:
+                # Query to fetch only necessary user info, excluding sensitive data like password
+                query = "SELECT " + USER_PROFILE_COLUMNS + " FROM users WHERE username = %s"
+                logger.debug("Fetching user info for username: %s", username)
+            
+                execute_prepared(cursor, "user_profile_by_username", query, (username,))
+                user = cursor.fetchone()
+            
+                if not user:
+                    # For security reasons, don't indicate whether the user exists or not
+                    # Just return a generic success response with empty data
+                    return jsonify({
+                        "success": True,
+                        "user": None
+                    }), 200
+            
+                body = orjson.dumps({
                     "success": True,
-                    "user": None
-                }), 200
-            
-            # Convert to a dictionary with proper field names
-            user_data = {
-                "id": int(user[0]) if user[0] is not None else None,
-                "username": str(user[1]) if user[1] is not None else None,
-                "email": str(user[2]) if user[2] is not None else None,
-                "created_at": user[3].isoformat() if user[3] is not None else None,
-                "last_login": user[4].isoformat() if user[4] is not None else None,
-                "total_points": int(user[5]) if user[5] is not None else 0,
-                "weekly_points": int(user[6]) if user[6] is not None else 0,
-                "predictions_made": int(user[7]) if user[7] is not None else 0,
-                "correct_predictions": int(user[8]) if user[8] is not None else 0
-            }
-            
-            return jsonify({
-                "success": True,
-                "user": user_data
-            }), 200
+                    "user": user
+                })
+                with _user_cache_lock:
+                    _user_info_cache[username] = body
+                return json_response(body), 200
             
-        except Exception as e:
-            logger.error(f"Database error in user_info: {e}")
-            return jsonify({"error": "Database error", "details": str(e)}), 500
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                logger.error("Database error in user_info: %s", e)
+                return jsonify({"error": "Database error", "details": str(e)}), 500
             
     except Exception as e:
-        logger.error(f"Unexpected error in user_info: {e}")
+        logger.error("Unexpected error in user_info: %s", e)
         return jsonify({"error": "Server error", "details": str(e)}), 500
 
 @auth_bp.route("/update-profile", methods=["PUT"])
 @jwt_required()
-@limiter.limit("10 per minute", key_func=get_real_ip)
+@limiter.limit("10 per minute")
 def update_profile():
     """Update user profile information (username, email, password)."""
     try:
@@ -759,94 +772,88 @@ def update_profile():
         data = request.get_json()
         
         # Get current data to check what's changed
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with db_cursor() as cursor:
             cursor.execute(
                 "SELECT username, email, password_hash FROM users WHERE id = %s",
                 (user_id,)
             )
             user = cursor.fetchone()
             
-            if not user:
-                return jsonify({"error": "User not found"}), 404
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+            
+        current_username, current_email, current_password_hash = user
+        
+        # Check what fields were provided and update them
+        updates = {}
+        update_fields = []
+        update_values = []
+        
+        # Handle password update first: the bcrypt work happens here, before a
+        # connection is taken for the UPDATE
+        if 'current_password' in data and 'new_password' in data:
+            # Verify current password
+            if not bcrypt.check_password_hash(current_password_hash, data['current_password']):
+                return jsonify({"error": "Current password is incorrect"}), 401
                 
-            current_username, current_email, current_password_hash = user
+            # Hash and update password
+            password_hash = bcrypt.generate_password_hash(data['new_password']).decode('utf-8')
+            update_fields.append("password_hash = %s")
+            update_values.append(password_hash)
+            updates['password_updated'] = True
+        
+        # Username and email availability is left to the unique constraints:
+        # a clash surfaces as an IntegrityError from the UPDATE below
+        if 'username' in data and data['username'] != current_username:
+            update_fields.append("username = %s")
+            update_values.append(data['username'])
+            updates['username'] = data['username']
+        
+        if 'email' in data and data['email'] != current_email:
+            update_fields.append("email = %s")
+            update_values.append(data['email'])
+            updates['email'] = data['email']
+        
+        # If there are no updates, return early
+        if not update_fields:
+            return jsonify({"message": "No changes made"}), 200
+        
+        with db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        
+            try:
+                # Build and execute update query
+                query = ("UPDATE users SET " + ", ".join(update_fields) +
+                         " WHERE id = %s RETURNING " + USER_PROFILE_COLUMNS)
+                update_values.append(user_id)
+            
+                cursor.execute(query, update_values)
+                profile = cursor.fetchone()
+                conn.commit()
+                # user still holds the old username, which is what was cached
+                invalidate_user_cache(user_id, user[0])
+                cache_user_profile(profile)
             
-            # Check what fields were provided and update them
-            updates = {}
-            update_fields = []
-            update_values = []
+                return jsonify({
+                    "message": "Profile updated successfully",
+                    "updates": updates
+                }), 200
             
-            # Handle username update
-            if 'username' in data and data['username'] != current_username:
-                # Check if username is available
-                cursor.execute(
-                    "SELECT EXISTS(SELECT 1 FROM users WHERE username = %s AND id != %s)",
-                    (data['username'], user_id)
-                )
-                username_exists = cursor.fetchone()[0]
-                
-                if username_exists:
+            except psycopg2.IntegrityError as e:
+                conn.rollback()
+                logger.error("Database integrity error in update_profile: %s", e)
+                if e.diag.constraint_name == USERNAME_UNIQUE_CONSTRAINT:
                     return jsonify({"error": "Username already taken"}), 409
-                    
-                update_fields.append("username = %s")
-                update_values.append(data['username'])
-                updates['username'] = data['username']
-            
-            # Handle email update
-            if 'email' in data and data['email'] != current_email:
-                # Check if email is available
-                cursor.execute(
-                    "SELECT EXISTS(SELECT 1 FROM users WHERE email = %s AND id != %s)",
-                    (data['email'], user_id)
-                )
-                email_exists = cursor.fetchone()[0]
-                
-                if email_exists:
+                if e.diag.constraint_name == EMAIL_UNIQUE_CONSTRAINT:
                     return jsonify({"error": "Email already registered"}), 409
-                    
-                update_fields.append("email = %s")
-                update_values.append(data['email'])
-                updates['email'] = data['email']
-            
-            # Handle password update
-            if 'current_password' in data and 'new_password' in data:
-                # Verify current password
-                if not bcrypt.check_password_hash(current_password_hash, data['current_password']):
-                    return jsonify({"error": "Current password is incorrect"}), 401
-                    
-                # Hash and update password
-                password_hash = bcrypt.generate_password_hash(data['new_password']).decode('utf-8')
-                update_fields.append("password_hash = %s")
-                update_values.append(password_hash)
-                updates['password_updated'] = True
-            
-            # If there are no updates, return early
-            if not update_fields:
-                return jsonify({"message": "No changes made"}), 200
-                
-            # Build and execute update query
-            query = "UPDATE users SET " + ", ".join(update_fields) + " WHERE id = %s"
-            update_values.append(user_id)
-            
-            cursor.execute(query, update_values)
-            conn.commit()
-            
-            return jsonify({
-                "message": "Profile updated successfully",
-                "updates": updates
-            }), 200
-            
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error in update_profile: {e}")
-            return jsonify({"error": "Failed to update profile", "details": str(e)}), 500
-        finally:
-            cursor.close()
-            conn.close()
+                return jsonify({"error": "Failed to update profile"}), 400
+            except Exception as e:
+                conn.rollback()
+                logger.error("Database error in update_profile: %s", e)
+                return jsonify({"error": "Failed to update profile", "details": str(e)}), 500
+            finally:
+                cursor.close()
             
     except Exception as e:
-        logger.error(f"Unexpected error in update_profile: {e}")
+        logger.error("Unexpected error in update_profile: %s", e)
         return jsonify({"error": "An unexpected error occurred", "details": str(e)}), 500
\ No newline at end of file
@@ -1,11 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
 import os
-import psycopg2
-import json
-from datetime import datetime
+import re
+import orjson
+from datetime import date
+from cachetools import TTLCache
+from concurrent.futures import Future
 import logging
-from __init__ import limiter, get_real_ip
+import threading
+from __init__ import limiter, json_response
+from db import db_connection, db_cursor, to_jsonb
 
 charts_bp = Blueprint("charts", __name__)
 
@@ -13,152 +20,246 @@ RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
 RAPIDAPI_HOST = "billboard-charts-api.p.rapidapi.com"
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-logging.basicConfig(level=logging.DEBUG)
+# Accepted /chart parameters: chart slugs like "hot-100" (top-charts ids carry a
+# trailing slash), ranges like "1-10"
+CHART_ID_RE = re.compile(r"^[A-Za-z0-9-]{1,64}/?$")
+RANGE_RE = re.compile(r"^\d{1,3}-\d{1,3}$")
+
+# Upstream requests wait at most this long (seconds) before failing
+RAPIDAPI_TIMEOUT = 5
+
+# One session per worker so the TCP/TLS connection to RapidAPI is reused
+rapidapi_session = requests.Session()
+rapidapi_session.headers.update({
+    "x-rapidapi-key": RAPIDAPI_KEY,
+    "x-rapidapi-host": RAPIDAPI_HOST
+})
+rapidapi_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.2)
+))
+atexit.register(rapidapi_session.close)
+
+# Chart data only changes weekly, so keep recent lookups in memory and skip
+# both Postgres and RapidAPI for repeat requests. Keyed on (chart_id, week),
+# or the endpoint for chart-independent calls.
+CHART_CACHE_TTL = 3600
+_chart_cache = TTLCache(maxsize=512, ttl=CHART_CACHE_TTL)
+_chart_cache_lock = threading.Lock()
+
+# Lookups currently in progress, keyed like _chart_cache. Concurrent misses on
+# the same key wait on the first request's Future instead of all calling RapidAPI.
+INFLIGHT_TIMEOUT = 30
+_inflight = {}
+
+# Serialized /chart response bodies, keyed on (chart_id, week, start, end), and
+# the /top-charts body under TOP_CHARTS_RESPONSE_KEY, so repeat requests skip
+# the lookup, slicing and encoding
+_response_cache = TTLCache(maxsize=512, ttl=CHART_CACHE_TTL)
+_response_cache_lock = threading.Lock()
+TOP_CHARTS_RESPONSE_KEY = ("top-charts",)
+
+logger = logging.getLogger(__name__)
 
 if not RAPIDAPI_KEY:
-    logging.error("RAPIDAPI_KEY is missing! API requests will fail.")
+    logger.error("RAPIDAPI_KEY is missing! API requests will fail.")
     raise RuntimeError("RAPIDAPI_KEY is not set. Check your environment variables.")
 
-def get_db_connection():
+def fetch_api(endpoint, chart_id=None, historical_week=None):
+    """Return ``{"source": ..., "data": ...}`` for an endpoint, from cache, DB or RapidAPI.
+
+    The returned data may be shared with the cache, so callers must not mutate it.
+    """
+    cache_key = (chart_id, historical_week) if chart_id and historical_week else (endpoint,)
+    with _chart_cache_lock:
+        cached = _chart_cache.get(cache_key)
+        if cached is None:
+            # Only one request per key goes to Postgres/RapidAPI; the rest wait for it
+            future = _inflight.get(cache_key)
+            owner = future is None
+            if owner:
+                future = _inflight[cache_key] = Future()
+    if cached is not None:
+        return {"source": "database", "data": cached}
+
+    if not owner:
+        return future.result(timeout=INFLIGHT_TIMEOUT)
+
     try:
-        return psycopg2.connect(DATABASE_URL)
+        payload = _load_chart(endpoint, chart_id, historical_week, cache_key)
     except Exception as e:
-        logging.error(f"Database connection error: {e}")
+        future.set_exception(e)
         raise
+    else:
+        future.set_result(payload)
+        return payload
+    finally:
+        with _chart_cache_lock:
+            _inflight.pop(cache_key, None)
 
-def fetch_api(endpoint, chart_id=None, historical_week=None):
+def _load_chart(endpoint, chart_id, historical_week, cache_key):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
+        # The connection is only held for the lookup, not across the RapidAPI call
+        with db_cursor() as cursor:
             # For top-charts endpoint
             if endpoint == "/top-charts.php":
-                logging.debug("Checking database for top charts")
+                logger.debug("Checking database for top charts")
                 cursor.execute("SELECT data FROM top_charts ORDER BY created_at DESC LIMIT 1")
                 existing_record = cursor.fetchone()
-                
+            
                 if existing_record:
-                    logging.debug("Found top charts in database")
-                    # Handle the data correctly based on its type
+                    logger.debug("Found top charts in database")
                     data = existing_record[0]
-                    if isinstance(data, str):
-                        data = json.loads(data)
-                    return jsonify({
-                        "source": "database",
-                        "data": data
-                    })
-                logging.debug("No top charts found in database")
-            
+                    return _remember(cache_key, "database", data)
+                logger.debug("No top charts found in database")
+
             # For individual charts
             elif chart_id and historical_week:
                 cursor.execute("SELECT data FROM charts WHERE title = %s AND week = %s", (chart_id, historical_week))
                 existing_record = cursor.fetchone()
-                
+            
                 if existing_record:
+                    # JSONB column, so psycopg2 already returns parsed data
                     data = existing_record[0]
-                    if isinstance(data, str):
-                        data = json.loads(data)
-                    return jsonify({
-                        "source": "database",
-                        "data": data
-                    })
-            
-            # Fetch from API if not found in DB
-            if not RAPIDAPI_KEY:
-                return jsonify({"error": "Missing API key"}), 500
-
-            headers = {
-                "x-rapidapi-key": RAPIDAPI_KEY,
-                "x-rapidapi-host": RAPIDAPI_HOST
-            }
-            url = f"https://{RAPIDAPI_HOST}{endpoint}"
+                    return _remember(cache_key, "database", data)
             
-            logging.debug(f"Fetching from API: {url}")
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            api_data = response.json()
-            logging.debug(f"API response received: {api_data}")
+        # Fetch from API if not found in DB
+        if not RAPIDAPI_KEY:
+            raise RuntimeError("Missing API key")
+
+        url = f"https://{RAPIDAPI_HOST}{endpoint}"
+        
+        logger.debug("Fetching from API: %s", url)
+        response = rapidapi_session.get(url, timeout=RAPIDAPI_TIMEOUT)
+        response.raise_for_status()
+        api_data = orjson.loads(response.content)
+        logger.debug("API response received: %s", api_data)
+        
+        # Store in appropriate table
+        if endpoint == "/top-charts.php":
+            store_top_charts(api_data)
+        elif chart_id and historical_week:
+            store_chart_data(api_data, chart_id, historical_week)
+        
+        return _remember(cache_key, "api", api_data)
+    except Exception as e:
+        logger.error("Error in fetch_api: %s", e)
+        raise
+
+def _remember(cache_key, source, data):
+    # Whatever the first source was, the data is in Postgres by now, so later
+    # cache hits are reported as "database"
+    with _chart_cache_lock:
+        _chart_cache[cache_key] = data
+    return {"source": source, "data": data}
+
+def store_top_charts(data):
+    """Stores the latest top charts listing in PostgreSQL."""
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
             
-            # Store in appropriate table
-            if endpoint == "/top-charts.php":
-                logging.debug("Storing top charts in database")
-                # Store the data as a JSON string
-                cursor.execute(
-                    "INSERT INTO top_charts (data) VALUES (%s)",
-                    (json.dumps(api_data),)
-                )
-                conn.commit()
-                logging.debug("Top charts stored successfully")
-            elif chart_id and historical_week:
-                store_chart_data(api_data, chart_id, historical_week)
+            logger.debug("Storing top charts in database")
+            cursor.execute(
+                "INSERT INTO top_charts (data) VALUES (%s)",
+                (to_jsonb(data),)
+            )
+            conn.commit()
+            logger.debug("Top charts stored successfully")
             
-            return jsonify({
-                "source": "api",
-                "data": api_data
-            })
-        except Exception as e:
-            logging.error(f"Error in fetch_api: {e}")
-            raise
-        finally:
             cursor.close()
-            conn.close()
     except Exception as e:
-        logging.error(f"Unhandled error in fetch_api: {e}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("Error storing top charts: %s", e)
+        raise
 
 def store_chart_data(data, chart_id, historical_week):
     """Stores chart data in PostgreSQL if it doesn't already exist."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM charts WHERE title = %s AND week = %s", (chart_id, historical_week))
-        existing_record = cursor.fetchone()
-        
-        if not existing_record:
-            cursor.execute("INSERT INTO charts (title, week, data) VALUES (%s, %s, %s)", 
-                         (chart_id, historical_week, json.dumps(data)))
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # A concurrent request may have stored the same week already; the
+            # unique (title, week) constraint makes that a no-op, not an error
+            cursor.execute(
+                "INSERT INTO charts (title, week, data) VALUES (%s, %s, %s) "
+                "ON CONFLICT (title, week) DO NOTHING",
+                (chart_id, historical_week, to_jsonb(data))
+            )
             conn.commit()
-        
-        cursor.close()
-        conn.close()
+            
+            cursor.close()
     except Exception as e:
-        logging.error(f"Error storing chart data: {e}")
+        logger.error("Error storing chart data: %s", e)
         raise
 
+def _with_cache_headers(response, etag):
+    # Weak: the body's "source" differs between the first fetch and later hits
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = f"public, max-age={CHART_CACHE_TTL}"
+    return response
+
 @charts_bp.route("/top-charts", methods=["GET"])
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_top_charts():
     try:
-        logging.debug("Top charts endpoint called")
-        return fetch_api("/top-charts.php")
+        logger.debug("Top charts endpoint called")
+        with _response_cache_lock:
+            cached = _response_cache.get(TOP_CHARTS_RESPONSE_KEY)
+        if cached is not None:
+            return json_response(cached)
+
+        payload = fetch_api("/top-charts.php")
+        with _response_cache_lock:
+            _response_cache[TOP_CHARTS_RESPONSE_KEY] = orjson.dumps({"source": "database", "data": payload["data"]})
+        return json_response(payload)
     except Exception as e:
-        logging.error(f"Error in get_top_charts: {e}")
+        logger.error("Error in get_top_charts: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @charts_bp.route("/chart", methods=["GET"])
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_chart_details():
     try:
         chart_id = request.args.get("id", "hot-100")
-        historical_week = request.args.get("week", datetime.today().strftime('%Y-%m-%d'))
+        historical_week = request.args.get("week") or date.today().isoformat()
+        try:
+            # Single C call for the fixed YYYY-MM-DD shape; also normalizes the cache key
+            historical_week = date.fromisoformat(historical_week).isoformat()
+        except ValueError:
+            return jsonify({"error": "Invalid week format. Use 'YYYY-MM-DD' format."}), 400
+        if not CHART_ID_RE.match(chart_id):
+            return jsonify({"error": "Invalid chart id."}), 400
         range_param = request.args.get("range", "1-10")  # Default to first 10 entries
+        # Bounded and normalized, so "01-10" and "1-10" share one cache entry
+        if not RANGE_RE.match(range_param):
+            return jsonify({"error": "Invalid range format. Use 'start-end' format."}), 400
+        start, end = map(int, range_param.split("-"))
 
-        response = fetch_api(f"/chart.php?id={chart_id}&week={historical_week}", chart_id, historical_week)
-        
-        if isinstance(response, tuple) and response[1] != 200:
-            return response  # Return error response if any
-
-        data = response.get_json()
-        if "data" in data and isinstance(data["data"], dict) and "songs" in data["data"]:
-            try:
-                start, end = map(int, range_param.split("-"))
-                data["data"]["songs"] = data["data"]["songs"][start-1:end]  # Slice the song list
-            except ValueError:
-                return jsonify({"error": "Invalid range format. Use 'start-end' format."}), 400
-
-        return jsonify(data)
+        response_key = (chart_id, historical_week, start, end)
+
+        # A stored chart week never changes, so the key itself identifies the
+        # content; clients revalidating it get a 304 without any lookup
+        etag = f"{chart_id}:{historical_week}:{start}-{end}"
+        if request.if_none_match.contains_weak(etag):
+            return _with_cache_headers(Response(status=304), etag)
+
+        with _response_cache_lock:
+            cached = _response_cache.get(response_key)
+        if cached is not None:
+            return _with_cache_headers(json_response(cached), etag)
+
+        payload = fetch_api(f"/chart.php?id={chart_id}&week={historical_week}", chart_id, historical_week)
+
+        data = payload["data"]
+        if isinstance(data, dict) and "songs" in data:
+            # Copy rather than slice in place; the full chart is shared with the cache
+            data = {**data, "songs": data["songs"][start-1:end]}
+
+        # Cache the serialized body so hits skip JSON encoding entirely
+        with _response_cache_lock:
+            _response_cache[response_key] = orjson.dumps({"source": "database", "data": data})
+        return _with_cache_headers(json_response({"source": payload["source"], "data": data}), etag)
     except Exception as e:
-        logging.error(f"Error in get_chart_details: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        logger.error("Error in get_chart_details: %s", e)
+        return jsonify({"error": str(e)}), 500
@@ -1,22 +1,166 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection as _connection
+from psycopg2.extras import Json, register_default_json, register_default_jsonb
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from contextlib import contextmanager
+import atexit
 import os
 import logging
-import time
+import threading
+import orjson
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-logging.basicConfig(level=logging.DEBUG)
+# Bounds for each worker's connection pool. DB_POOL_MIN connections are opened
+# when the pool is created; more are opened on demand up to DB_POOL_MAX and then
+# kept (see WaitingConnectionPool). Every Gunicorn worker has its own pool, so
+# workers x DB_POOL_MAX, plus the prediction processor and admin sessions, must
+# stay under the database's max_connections.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# How long a request waits for a free connection once all DB_POOL_MAX are in
+# use, before giving up with PoolError
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
 
-def get_db_connection(retries=3, delay=5):
-    for attempt in range(retries):
+# Run hot queries as server-side prepared statements, so Postgres parses and
+# plans them once per connection. Turn off (DB_PREPARED_STATEMENTS=0) behind a
+# transaction-mode pooler such as PgBouncer, which doesn't keep them per client.
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") != "0"
+
+logger = logging.getLogger(__name__)
+
+# Decode json/jsonb columns with orjson instead of the stdlib parser
+register_default_json(globally=True, loads=orjson.loads)
+register_default_jsonb(globally=True, loads=orjson.loads)
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+def to_jsonb(obj):
+    """Wrap ``obj`` for binding to a json/jsonb parameter, serialized with orjson."""
+    return Json(obj, dumps=_orjson_dumps)
+
+class PreparingConnection(_connection):
+    """Connection that remembers which named statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+def execute_prepared(cursor, name, query, params=()):
+    """Execute ``query`` (with ``%s`` placeholders) as prepared statement ``name``.
+
+    The statement is prepared the first time a connection runs it; after that
+    only ``EXECUTE`` and the parameters are sent. Prepared statements outlive
+    transactions, so a rollback doesn't undo the bookkeeping.
+    """
+    conn = cursor.connection
+    if not DB_PREPARED_STATEMENTS or not isinstance(conn, PreparingConnection):
+        cursor.execute(query, params)
+        return
+    if name not in conn.prepared:
+        # Postgres numbers its placeholders: the n-th %s becomes $n
+        parts = query.split("%s")
+        numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+        cursor.execute(f"PREPARE {name} AS {numbered}")
+        conn.prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+class WaitingConnectionPool(ThreadedConnectionPool):
+    """Connection pool whose ``getconn()`` waits for a free connection.
+
+    psycopg2's pool raises PoolError as soon as all ``maxconn`` connections
+    are out. A gevent worker runs far more requests at once than that, so
+    callers queue on a semaphore instead (gevent-aware once threading is
+    monkey-patched) and only fail after DB_POOL_TIMEOUT.
+
+    Returned connections are kept open rather than closed once ``minconn``
+    are idle, so their prepared statements survive; only ``minconn`` are
+    opened up front.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # psycopg2 only uses minconn for the eager opens above and as the idle
+        # count past which putconn() closes connections. Raising it now keeps
+        # every connection without opening them all at startup.
+        self.minconn = self.maxconn
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise PoolError("timed out waiting for a database connection")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return this process's connection pool, creating it on first use.
+
+    The pool is keyed on the PID so a forked Gunicorn worker never reuses
+    sockets opened by its parent.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                logger.info("Opening database connection pool (%d-%d)", DB_POOL_MIN, DB_POOL_MAX)
+                _pool = WaitingConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL,
+                    connection_factory=PreparingConnection
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def close_pool():
+    """Close every connection in this process's pool, if it has one."""
+    global _pool
+    with _pool_lock:
+        # A pool inherited across fork belongs to the parent; leave its sockets alone
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+atexit.register(close_pool)
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection for the duration of a ``with`` block.
+
+    The connection goes back to the pool afterwards; psycopg2 rolls back any
+    transaction that was left open and discards connections that were closed.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+@contextmanager
+def db_cursor(cursor_factory=None):
+    """Borrow a pooled connection and yield a cursor on it, for read-only work.
+
+    The cursor is closed and the connection returned when the block exits.
+    Blocks that write should use ``db_connection()`` so they can commit.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=cursor_factory)
         try:
-            conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-            logging.debug("Database connection successful")
-            return conn
-        except Exception as e:
-            logging.error(f"Database connection attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:
-                time.sleep(delay)
-    
-    raise RuntimeError("Database connection failed after multiple attempts")
+            yield cursor
+        finally:
+            cursor.close()
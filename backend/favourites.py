@@ -1,107 +1,66 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from __init__ import limiter, get_real_ip
+from __init__ import limiter, json_response
+from db import db_connection, db_cursor
 import logging
-import psycopg2
-import os
 
 favourites_bp = Blueprint("favourites", __name__)
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    try:
-        return psycopg2.connect(DATABASE_URL)
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
-
 @favourites_bp.route("/favourites", methods=["GET"])
 @jwt_required()
-@limiter.limit("120 per minute", key_func=get_real_ip)
+@limiter.limit("120 per minute")
 def get_favourites():
     """Get all favourites for the authenticated user."""
     user_id = get_jwt_identity()
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get favourites with chart metadata
-        query = """
-        SELECT 
-            id, song_name, artist, chart_id, chart_title, 
-            position, image_url, peak_position, weeks_on_chart, 
-            last_week_position, added_at
-        FROM 
-            user_favourites
-        WHERE 
-            user_id = %s
-        ORDER BY 
-            added_at DESC
-        """
-        
-        cursor.execute(query, (user_id,))
-        favourites = cursor.fetchall()
-        
-        # Transform into a list of dictionaries
-        results = []
-        for fav in favourites:
-            results.append({
-                "id": fav[0],
-                "song_name": fav[1],
-                "artist": fav[2],
-                "chart_id": fav[3],
-                "chart_title": fav[4],
-                "position": fav[5],
-                "image_url": fav[6],
-                "peak_position": fav[7],
-                "weeks_on_chart": fav[8],
-                "last_week_position": fav[9],
-                "added_at": fav[10].isoformat() if fav[10] else None
-            })
-        
-        # Group by song and artist to show multiple chart appearances
-        grouped_results = {}
-        for item in results:
-            key = f"{item['song_name']}||{item['artist']}"
-            if key not in grouped_results:
-                grouped_results[key] = {
-                    "song_name": item["song_name"],
-                    "artist": item["artist"],
-                    "image_url": item["image_url"],
-                    "charts": [],
-                    "first_added_at": item["added_at"]
-                }
-            
-            grouped_results[key]["charts"].append({
-                "id": item["id"],
-                "chart_id": item["chart_id"],
-                "chart_title": item["chart_title"],
-                "position": item["position"],
-                "peak_position": item["peak_position"],
-                "weeks_on_chart": item["weeks_on_chart"],
-                "last_week_position": item["last_week_position"], 
-                "added_at": item["added_at"]
-            })
-        
-        # Convert back to list
-        final_results = list(grouped_results.values())
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({"favourites": final_results}), 200
+        with db_cursor() as cursor:
+            # Get favourites grouped by song and artist to show multiple chart
+            # appearances. Postgres builds the whole response body, so it is
+            # returned as text and sent without decoding or re-encoding it.
+            query = """
+            SELECT json_build_object(
+                'favourites', COALESCE(json_agg(g ORDER BY g.first_added_at DESC), '[]'::json)
+            )::text
+            FROM (
+                SELECT 
+                    song_name,
+                    artist,
+                    (array_agg(image_url ORDER BY added_at DESC))[1] AS image_url,
+                    json_agg(json_build_object(
+                        'id', id,
+                        'chart_id', chart_id,
+                        'chart_title', chart_title,
+                        'position', position,
+                        'peak_position', peak_position,
+                        'weeks_on_chart', weeks_on_chart,
+                        'last_week_position', last_week_position,
+                        'added_at', added_at
+                    ) ORDER BY added_at DESC) AS charts,
+                    MAX(added_at) AS first_added_at
+                FROM 
+                    user_favourites
+                WHERE 
+                    user_id = %s
+                GROUP BY 
+                    song_name, artist
+            ) g
+            """
+        
+            cursor.execute(query, (user_id,))
+            body = cursor.fetchone()[0]
+        
+        return json_response(body.encode("utf-8")), 200
     
     except Exception as e:
-        logger.error(f"Error getting favourites: {e}")
+        logger.error("Error getting favourites: %s", e)
         return jsonify({"error": "Failed to retrieve favourites"}), 500
 
 @favourites_bp.route("/favourites", methods=["POST"])
 @jwt_required()
-@limiter.limit("120 per minute", key_func=get_real_ip)
+@limiter.limit("120 per minute")
 def add_favourite():
     """Add a song to favourites."""
     user_id = get_jwt_identity()
@@ -113,107 +72,103 @@ def add_favourite():
             return jsonify({"error": f"Missing required field: {field}"}), 400
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if this song from this chart is already favourited
-        cursor.execute(
-            """
-            SELECT id FROM user_favourites
-            WHERE user_id = %s AND song_name = %s AND artist = %s AND chart_id = %s
-            """,
-            (user_id, data["song_name"], data["artist"], data["chart_id"])
-        )
-        
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Already favourited - return success but with a message
-            cursor.close()
-            conn.close()
-            return jsonify({
-                "message": "Song is already in favourites",
-                "favourite_id": existing[0]
-            }), 200
+        with db_connection() as conn:
+            cursor = conn.cursor()
+        
+            # Check if this song from this chart is already favourited
+            cursor.execute(
+                """
+                SELECT id FROM user_favourites
+                WHERE user_id = %s AND song_name = %s AND artist = %s AND chart_id = %s
+                """,
+                (user_id, data["song_name"], data["artist"], data["chart_id"])
+            )
         
-        cursor.execute(
-            """
-            INSERT INTO user_favourites
-            (user_id, song_name, artist, chart_id, chart_title, position, image_url, peak_position, 
-             weeks_on_chart, last_week_position)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (
-                user_id,
-                data["song_name"],
-                data["artist"],
-                data["chart_id"],
-                data["chart_title"],
-                data.get("position"),
-                data.get("image_url"),
-                data.get("peak_position"),
-                data.get("weeks_on_chart"),
-                data.get("last_week_position") 
+            existing = cursor.fetchone()
+        
+            if existing:
+                # Already favourited - return success but with a message
+                cursor.close()
+                return jsonify({
+                    "message": "Song is already in favourites",
+                    "favourite_id": existing[0]
+                }), 200
+        
+            cursor.execute(
+                """
+                INSERT INTO user_favourites
+                (user_id, song_name, artist, chart_id, chart_title, position, image_url, peak_position, 
+                 weeks_on_chart, last_week_position)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+                """,
+                (
+                    user_id,
+                    data["song_name"],
+                    data["artist"],
+                    data["chart_id"],
+                    data["chart_title"],
+                    data.get("position"),
+                    data.get("image_url"),
+                    data.get("peak_position"),
+                    data.get("weeks_on_chart"),
+                    data.get("last_week_position") 
+                )
             )
-        )
         
-        favourite_id = cursor.fetchone()[0]
-        conn.commit()
+            favourite_id = cursor.fetchone()[0]
+            conn.commit()
         
-        cursor.close()
-        conn.close()
+            cursor.close()
         
-        return jsonify({
-            "message": "Song added to favourites",
-            "favourite_id": favourite_id
-        }), 201
+            return jsonify({
+                "message": "Song added to favourites",
+                "favourite_id": favourite_id
+            }), 201
     
     except Exception as e:
-        logger.error(f"Error adding favourite: {e}")
+        logger.error("Error adding favourite: %s", e)
         return jsonify({"error": "Failed to add song to favourites"}), 500
 
 @favourites_bp.route("/favourites/<int:favourite_id>", methods=["DELETE"])
 @jwt_required()
-@limiter.limit("120 per minute", key_func=get_real_ip)
+@limiter.limit("120 per minute")
 def remove_favourite(favourite_id):
     """Remove a song from favourites."""
     user_id = get_jwt_identity()
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        # Check if the favourite exists and belongs to this user
-        cursor.execute(
-            "SELECT id FROM user_favourites WHERE id = %s AND user_id = %s",
-            (favourite_id, user_id)
-        )
+            # Check if the favourite exists and belongs to this user
+            cursor.execute(
+                "SELECT id FROM user_favourites WHERE id = %s AND user_id = %s",
+                (favourite_id, user_id)
+            )
         
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Favourite not found or unauthorized"}), 404
+            if not cursor.fetchone():
+                cursor.close()
+                return jsonify({"error": "Favourite not found or unauthorized"}), 404
         
-        # Delete the favourite
-        cursor.execute(
-            "DELETE FROM user_favourites WHERE id = %s AND user_id = %s",
-            (favourite_id, user_id)
-        )
+            # Delete the favourite
+            cursor.execute(
+                "DELETE FROM user_favourites WHERE id = %s AND user_id = %s",
+                (favourite_id, user_id)
+            )
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
         
-        return jsonify({"message": "Favourite removed successfully"}), 200
+            return jsonify({"message": "Favourite removed successfully"}), 200
     
     except Exception as e:
-        logger.error(f"Error removing favourite: {e}")
+        logger.error("Error removing favourite: %s", e)
         return jsonify({"error": "Failed to remove favourite"}), 500
 
 @favourites_bp.route("/favourites/check", methods=["GET"])
 @jwt_required()
-@limiter.limit("120 per minute", key_func=get_real_ip)
+@limiter.limit("120 per minute")
 def check_favourite():
     """Check if a song is already favourited by the user."""
     user_id = get_jwt_identity()
@@ -225,31 +180,26 @@ def check_favourite():
         return jsonify({"error": "Missing required parameters"}), 400
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if favourited
-        cursor.execute(
-            """
-            SELECT id FROM user_favourites
-            WHERE user_id = %s AND song_name = %s AND artist = %s AND chart_id = %s
-            """,
-            (user_id, song_name, artist, chart_id)
-        )
-        
-        result = cursor.fetchone()
+        with db_cursor() as cursor:
+            # Check if favourited
+            cursor.execute(
+                """
+                SELECT id FROM user_favourites
+                WHERE user_id = %s AND song_name = %s AND artist = %s AND chart_id = %s
+                """,
+                (user_id, song_name, artist, chart_id)
+            )
         
-        cursor.close()
-        conn.close()
+            result = cursor.fetchone()
         
-        is_favourited = bool(result)
-        favourite_id = result[0] if result else None
+            is_favourited = bool(result)
+            favourite_id = result[0] if result else None
         
-        return jsonify({
-            "is_favourited": is_favourited,
-            "favourite_id": favourite_id
-        }), 200
+            return jsonify({
+                "is_favourited": is_favourited,
+                "favourite_id": favourite_id
+            }), 200
     
     except Exception as e:
-        logger.error(f"Error checking favourite status: {e}")
+        logger.error("Error checking favourite status: %s", e)
         return jsonify({"error": "Failed to check favourite status"}), 500
\ No newline at end of file
@@ -0,0 +1,34 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app` (see Procfile)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# gevent workers let requests waiting on Postgres or RapidAPI yield to each
+# other instead of tying up a whole worker. bcrypt still runs in its own
+# process pool since gevent can't switch inside the C extension.
+# Each worker keeps up to DB_POOL_MAX Postgres connections (see db.py), so
+# size WEB_CONCURRENCY x DB_POOL_MAX to fit the database's max_connections.
+# Containers often report the host's CPU count, so set it explicitly there.
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+# Concurrent requests per worker. This is far more than the worker's
+# DB_POOL_MAX Postgres connections; requests that need the database queue in
+# db.WaitingConnectionPool for a free one (up to DB_POOL_TIMEOUT) rather than
+# failing, while the rest carry on.
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "500"))
+# Keep idle client connections open longer than the load balancer's idle
+# timeout (commonly 60s), or it may reuse a socket Gunicorn has just closed.
+# Idle keep-alive connections only cost a parked greenlet each.
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+
+def post_fork(server, worker):
+    # psycopg2 blocks in C by default; make it cooperate with the gevent hub
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+def worker_exit(server, worker):
+    # Graceful shutdown (SIGTERM) and max-requests restarts: hand this worker's
+    # pooled connections back to Postgres rather than leaving them to time out
+    from db import close_pool
+    close_pool()
@@ -0,0 +1,5 @@
+-- Store chart payloads as JSONB so psycopg2 hands back parsed objects instead
+-- of text that has to be decoded on every read.
+-- Apply with: psql "$DATABASE_URL" -f migrations/001_charts_data_jsonb.sql
+
+ALTER TABLE charts ALTER COLUMN data TYPE JSONB USING data::jsonb;
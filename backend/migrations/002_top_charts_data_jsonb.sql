@@ -0,0 +1,4 @@
+-- Same as 001 for the top charts listing, so reads come back already parsed.
+-- Apply with: psql "$DATABASE_URL" -f migrations/002_top_charts_data_jsonb.sql
+
+ALTER TABLE top_charts ALTER COLUMN data TYPE JSONB USING data::jsonb;
@@ -0,0 +1,8 @@
+-- The top charts lookup reads the newest row (ORDER BY created_at DESC LIMIT 1);
+-- index it so that is a single index probe instead of a scan and sort.
+-- charts lookups by (title, week) are already served by the unique constraint
+-- the ON CONFLICT (title, week) inserts depend on.
+-- Apply with: psql "$DATABASE_URL" -f migrations/003_top_charts_created_at_idx.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS top_charts_created_at_idx
+    ON top_charts (created_at DESC);
@@ -0,0 +1,13 @@
+-- Login looks users up by username, and register/update_profile rely on
+-- duplicate usernames and emails being rejected by the database. Make sure both
+-- columns have unique indexes. The names match the ones Postgres gives
+-- UNIQUE column constraints, so this is a no-op where those already exist.
+-- auth.py maps violations of these names to 409 responses.
+-- Apply with: psql "$DATABASE_URL" -f migrations/004_users_unique_username_email.sql
+-- (CONCURRENTLY can't run inside a transaction, so don't wrap it in one)
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_username_key
+    ON users (username);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_key
+    ON users (email);
@@ -0,0 +1,11 @@
+-- login reads id, username, email, password_hash by username. With the other
+-- three columns in the index, Postgres can answer it with an index-only scan
+-- instead of visiting the heap as well. (The lookup by id is covered by 005.)
+-- The index is deliberately not UNIQUE: users_username_key (004) enforces that,
+-- and auth.py identifies duplicate-username errors by that constraint's name.
+-- Apply with: psql "$DATABASE_URL" -f migrations/006_users_login_covering_idx.sql
+-- (CONCURRENTLY can't run inside a transaction, so don't wrap it in one)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_login_covering_idx
+    ON users (username)
+    INCLUDE (id, email, password_hash);
@@ -4,16 +4,18 @@
 
 import logging
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
+from psycopg2.extras import RealDictCursor, Json, execute_values
 import os
 from datetime import datetime, timedelta
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
 from typing import Dict, List, Any, Optional, Tuple
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -27,13 +29,27 @@ if not DATABASE_URL:
 # Billboard API credentials
 RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
 RAPIDAPI_HOST = "billboard-charts-api.p.rapidapi.com"
+RAPIDAPI_TIMEOUT = 10
+
+# One keep-alive session for every chart fetch in a run
+rapidapi_session = requests.Session()
+rapidapi_session.headers.update({
+    "x-rapidapi-key": RAPIDAPI_KEY,
+    "x-rapidapi-host": RAPIDAPI_HOST
+})
+rapidapi_session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+atexit.register(rapidapi_session.close)
 
 def get_db_connection():
     """Get a connection to the database"""
     try:
         return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
     except Exception as e:
-        logger.error(f"Database connection error: {e}")
+        logger.error("Database connection error: %s", e)
         raise
 
 def fetch_chart_data(chart_id: str, date: str) -> Dict:
@@ -49,7 +65,8 @@ def fetch_chart_data(chart_id: str, date: str) -> Dict:
     """
     # First try to get from database (cached data)
     conn = get_db_connection()
-    cursor = conn.cursor()
+    # Plain tuple cursor: only one column is read, so skip RealDictCursor's per-row dict
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
     
     try:
         # Check if we have this chart data already cached
@@ -60,20 +77,15 @@ def fetch_chart_data(chart_id: str, date: str) -> Dict:
         cached_data = cursor.fetchone()
         
         if cached_data:
-            logger.info(f"Using cached chart data for {chart_id} on {date}")
-            return cached_data["data"]
+            logger.info("Using cached chart data for %s on %s", chart_id, date)
+            return cached_data[0]
         
         # If not in database, fetch from API
         if not RAPIDAPI_KEY:
             logger.error("RAPIDAPI_KEY not set, cannot fetch chart data")
             raise EnvironmentError("RAPIDAPI_KEY must be set in environment variables")
         
-        logger.info(f"Fetching chart data from API for {chart_id} on {date}")
-        
-        headers = {
-            "x-rapidapi-key": RAPIDAPI_KEY,
-            "x-rapidapi-host": RAPIDAPI_HOST
-        }
+        logger.info("Fetching chart data from API for %s on %s", chart_id, date)
         
         url = f"https://{RAPIDAPI_HOST}/chart.php"
         params = {
@@ -81,21 +93,21 @@ def fetch_chart_data(chart_id: str, date: str) -> Dict:
             "week": date
         }
         
-        response = requests.get(url, headers=headers, params=params)
+        response = rapidapi_session.get(url, params=params, timeout=RAPIDAPI_TIMEOUT)
         response.raise_for_status()
         chart_data = response.json()
         
         # Store in database for future use
         cursor.execute(
-            "INSERT INTO charts (title, week, data) VALUES (%s, %s, %s) ON CONFLICT (title, week) DO UPDATE SET data = %s",
-            (chart_id, date, json.dumps(chart_data), json.dumps(chart_data))
+            "INSERT INTO charts (title, week, data) VALUES (%s, %s, %s) ON CONFLICT (title, week) DO UPDATE SET data = EXCLUDED.data",
+            (chart_id, date, Json(chart_data))
         )
         conn.commit()
         
         return chart_data
         
     except Exception as e:
-        logger.error(f"Error fetching chart data: {e}")
+        logger.error("Error fetching chart data: %s", e)
         conn.rollback()
         raise
     finally:
@@ -121,7 +133,7 @@ def get_current_active_contest() -> Optional[Dict]:
         contest = cursor.fetchone()
         return contest
     except Exception as e:
-        logger.error(f"Error fetching active contest: {e}")
+        logger.error("Error fetching active contest: %s", e)
         return None
     finally:
         cursor.close()
@@ -157,10 +169,10 @@ def close_active_contest() -> Optional[int]:
         )
         conn.commit()
         
-        logger.info(f"Contest ID {contest_id} has been closed")
+        logger.info("Contest ID %s has been closed", contest_id)
         return contest_id
     except Exception as e:
-        logger.error(f"Error closing contest: {e}")
+        logger.error("Error closing contest: %s", e)
         conn.rollback()
         return None
     finally:
@@ -214,10 +226,10 @@ def create_next_contest() -> Optional[int]:
         new_contest_id = cursor.fetchone()["id"]
         conn.commit()
         
-        logger.info(f"Created new contest ID {new_contest_id} starting {start_date} ending {end_date}, release date {next_tuesday}")
+        logger.info("Created new contest ID %s starting %s ending %s, release date %s", new_contest_id, start_date, end_date, next_tuesday)
         return new_contest_id
     except Exception as e:
-        logger.error(f"Error creating new contest: {e}")
+        logger.error("Error creating new contest: %s", e)
         conn.rollback()
         return None
     finally:
@@ -441,45 +453,32 @@ def evaluate_exit_prediction(prediction: Dict, current_chart: Dict, previous_cha
         "points": points
     }
 
-def update_user_stats(user_id: int, points: int, is_correct: bool) -> bool:
+def update_user_stats(cursor, user_stats: Dict[int, List[int]]) -> None:
     """
-    Update user statistics after a prediction is processed
+    Apply processed prediction results to user statistics in one statement
     
     Args:
-        user_id: User ID
-        points: Points earned
-        is_correct: Whether the prediction was correct
-        
-    Returns:
-        True if successful, False otherwise
+        cursor: Cursor on the processing transaction; the caller commits
+        user_stats: User ID -> [points earned, predictions made, correct predictions]
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Update user stats
-        cursor.execute(
-            """
-            UPDATE users
-            SET 
-                total_points = total_points + %s,
-                weekly_points = weekly_points + %s,
-                predictions_made = predictions_made + 1,
-                correct_predictions = correct_predictions + %s
-            WHERE id = %s
-            """,
-            (points, points, 1 if is_correct else 0, user_id)
-        )
-        
-        conn.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Error updating user stats: {e}")
-        conn.rollback()
-        return False
-    finally:
-        cursor.close()
-        conn.close()
+    if not user_stats:
+        return
+        
+    execute_values(
+        cursor,
+        """
+        UPDATE users
+        SET 
+            total_points = users.total_points + s.points,
+            weekly_points = users.weekly_points + s.points,
+            predictions_made = users.predictions_made + s.made,
+            correct_predictions = users.correct_predictions + s.correct
+        FROM (VALUES %s) AS s (user_id, points, made, correct)
+        WHERE users.id = s.user_id
+        """,
+        [(user_id, *stats) for user_id, stats in user_stats.items()],
+        page_size=500
+    )
 
 def generate_contest_stats_to_rules(contest_id: int) -> bool:
     """
@@ -592,11 +591,11 @@ def generate_contest_stats_to_rules(contest_id: int) -> bool:
         )
         
         conn.commit()
-        logger.info(f"Generated stats for contest {contest_id}")
+        logger.info("Generated stats for contest %s", contest_id)
         return True
     
     except Exception as e:
-        logger.error(f"Error generating contest stats: {e}")
+        logger.error("Error generating contest stats: %s", e)
         conn.rollback()
         return False
     finally:
@@ -629,7 +628,7 @@ def process_predictions(contest_id: int) -> bool:
         contest = cursor.fetchone()
         
         if not contest:
-            logger.error(f"Contest ID {contest_id} not found")
+            logger.error("Contest ID %s not found", contest_id)
             return False
             
         release_date = contest["chart_release_date"]
@@ -638,11 +637,11 @@ def process_predictions(contest_id: int) -> bool:
         previous_date = release_date - timedelta(days=7)
         
         # Format dates for API
-        release_date_str = release_date.strftime("%Y-%m-%d")
-        previous_date_str = previous_date.strftime("%Y-%m-%d")
+        release_date_str = release_date.isoformat()
+        previous_date_str = previous_date.isoformat()
         
         # Fetch current and previous chart data for both Hot 100 and Billboard 200
-        logger.info(f"Fetching chart data for Hot 100 and Billboard 200")
+        logger.info("Fetching chart data for Hot 100 and Billboard 200")
         hot100_current = fetch_chart_data("hot-100", release_date_str)
         hot100_previous = fetch_chart_data("hot-100", previous_date_str)
         billboard200_current = fetch_chart_data("billboard-200", release_date_str)
@@ -660,11 +659,14 @@ def process_predictions(contest_id: int) -> bool:
         )
         
         predictions = cursor.fetchall()
-        logger.info(f"Processing {len(predictions)} predictions for contest {contest_id}")
+        logger.info("Processing %s predictions for contest %s", len(predictions), contest_id)
+        
+        result_rows = []
+        user_stats = {}
         
         # Process each prediction
         for prediction in predictions:
-            logger.info(f"Processing prediction ID {prediction['id']} - {prediction['prediction_type']} for {prediction['song_name']}")
+            logger.info("Processing prediction ID %s - %s for %s", prediction['id'], prediction['prediction_type'], prediction['song_name'])
             
             # Select appropriate charts based on prediction chart type
             if prediction["chart_type"] == "hot-100":
@@ -682,7 +684,7 @@ def process_predictions(contest_id: int) -> bool:
             elif prediction["prediction_type"] == "exit":
                 result = evaluate_exit_prediction(prediction, current_chart, previous_chart)
             else:
-                logger.warning(f"Unknown prediction type: {prediction['prediction_type']}")
+                logger.warning("Unknown prediction type: %s", prediction['prediction_type'])
                 continue
                 
             # Save the result
@@ -693,33 +695,44 @@ def process_predictions(contest_id: int) -> bool:
             actual_position = result.get("actual_position")
             actual_change = result.get("actual_change")
             
-            logger.info(f"Prediction result: Correct: {is_correct}, Points: {points}")
+            logger.info("Prediction result: Correct: %s, Points: %s", is_correct, points)
             
-            # Insert the result into prediction_results
-            cursor.execute(
+            # Queue the result; all results are written in one batch below
+            result_rows.append((prediction_id, actual_position, actual_change, is_correct, points))
+            
+            # Accumulate per-user stats; applied in one UPDATE with the results
+            stats = user_stats.setdefault(user_id, [0, 0, 0])
+            stats[0] += points
+            stats[1] += 1
+            stats[2] += 1 if is_correct else 0
+            
+        if result_rows:
+            # Insert every result into prediction_results in one round trip
+            execute_values(
+                cursor,
                 """
                 INSERT INTO prediction_results
                 (prediction_id, actual_position, actual_change, is_correct, points_earned)
-                VALUES (%s, %s, %s, %s, %s)
+                VALUES %s
                 """,
-                (prediction_id, actual_position, actual_change, is_correct, points)
+                result_rows,
+                page_size=500
             )
             
-            # Mark the prediction as processed
+            # Mark the predictions as processed
             cursor.execute(
                 """
                 UPDATE predictions
                 SET processed = TRUE
-                WHERE id = %s
+                WHERE id = ANY(%s)
                 """,
-                (prediction_id,)
+                ([row[0] for row in result_rows],)
             )
             
-            # Update user stats
-            update_user_stats(user_id, points, is_correct)
+            update_user_stats(cursor, user_stats)
             
         conn.commit()
-        logger.info(f"Successfully processed all predictions for contest {contest_id}")
+        logger.info("Successfully processed all predictions for contest %s", contest_id)
         
         # Generate contest stats
         generate_contest_stats_to_rules(contest_id)
@@ -739,7 +752,7 @@ def process_predictions(contest_id: int) -> bool:
         return True
     
     except Exception as e:
-        logger.error(f"Error processing predictions: {e}")
+        logger.error("Error processing predictions: %s", e)
         conn.rollback()
         return False
     finally:
@@ -765,10 +778,10 @@ def run_weekly_processor() -> bool:
             # Step 2: Process predictions for the closed contest
             success = process_predictions(contest_id)
             if not success:
-                logger.error(f"Failed to process predictions for contest {contest_id}")
+                logger.error("Failed to process predictions for contest %s", contest_id)
                 return False
                 
-            logger.info(f"Successfully processed predictions for contest {contest_id}")
+            logger.info("Successfully processed predictions for contest %s", contest_id)
         
         # Step 3: Create a new contest for the next week
         new_contest_id = create_next_contest()
@@ -777,14 +790,14 @@ def run_weekly_processor() -> bool:
             logger.error("Failed to create new contest")
             return False
             
-        logger.info(f"Successfully created new contest with ID {new_contest_id}")
+        logger.info("Successfully created new contest with ID %s", new_contest_id)
         
         # If we get here, everything was successful
         logger.info("Weekly prediction processing completed successfully")
         return True
         
     except Exception as e:
-        logger.error(f"Error in weekly prediction processing: {e}")
+        logger.error("Error in weekly prediction processing: %s", e)
         return False
 
 if __name__ == "__main__":
@@ -1,54 +1,55 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from __init__ import limiter, get_real_ip
+from __init__ import limiter, json_response
+from db import db_connection, db_cursor
+from cachetools import TTLCache
 import logging
-import psycopg2
-import os
+import threading
 from datetime import datetime, timedelta
 
 predictions_bp = Blueprint("predictions", __name__)
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    try:
-        return psycopg2.connect(DATABASE_URL)
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Predictions each user may submit per contest
+MAX_PREDICTIONS_PER_CONTEST = 10
+
+# Serialized leaderboard bodies, keyed on (period, contest_id, limit). Points only
+# change when the weekly processor runs, so serve repeats from memory for a while.
+LEADERBOARD_CACHE_TTL = 300
+_leaderboard_cache = TTLCache(maxsize=256, ttl=LEADERBOARD_CACHE_TTL)
+_leaderboard_cache_lock = threading.Lock()
+
+def _leaderboard_response(body):
+    response = json_response(body)
+    response.headers["Cache-Control"] = f"public, max-age={LEADERBOARD_CACHE_TTL}"
+    return response
 
 # Helper function to check if a prediction contest is active
 def get_current_active_contest():
     """Get the current active prediction contest"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Get the current active contest
-        cursor.execute(
-            """
-            SELECT id, start_date, end_date, chart_release_date, status
-            FROM weekly_contests
-            WHERE status = 'open'
-            ORDER BY start_date DESC
-            LIMIT 1
-            """
-        )
+    with db_cursor() as cursor:
+        try:
+            # Get the current active contest
+            cursor.execute(
+                """
+                SELECT id, start_date, end_date, chart_release_date, status
+                FROM weekly_contests
+                WHERE status = 'open'
+                ORDER BY start_date DESC
+                LIMIT 1
+                """
+            )
         
-        contest = cursor.fetchone()
-        return contest
-    except Exception as e:
-        logger.error(f"Error fetching active contest: {e}")
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+            contest = cursor.fetchone()
+            return contest
+        except Exception as e:
+            logger.error("Error fetching active contest: %s", e)
+            return None
 
 # GET /api/predictions/current-contest - Returns active prediction window info
 @predictions_bp.route("/predictions/current-contest", methods=["GET"])
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_current_contest():
     """Get the current active prediction contest information"""
     try:
@@ -63,30 +64,30 @@ def get_current_contest():
         return jsonify({
             "active": True,
             "contest_id": contest[0],
-            "start_date": contest[1].isoformat() if contest[1] else None,
-            "end_date": contest[2].isoformat() if contest[2] else None,
-            "chart_release_date": contest[3].isoformat() if contest[3] else None,
+            "start_date": contest[1],
+            "end_date": contest[2],
+            "chart_release_date": contest[3],
             "status": contest[4]
         }), 200
         
     except Exception as e:
-        logger.error(f"Error getting current contest: {e}")
+        logger.error("Error getting current contest: %s", e)
         return jsonify({"error": "Failed to retrieve contest information"}), 500
 
 # POST /api/predictions - Submit a new prediction
 @predictions_bp.route("/predictions", methods=["POST"])
 @jwt_required()
-@limiter.limit("60 per minute", key_func=get_real_ip)
+@limiter.limit("60 per minute")
 def submit_prediction():
     """Submit a new prediction for a Billboard chart"""
     
-    # Debug the authentication state
     user_id = get_jwt_identity()
-    auth_header = request.headers.get('Authorization', None)
     
-    # Log the authentication details
-    logging.info(f"Submitting prediction with user_id: {user_id}")
-    logging.debug(f"Auth header: {auth_header[:15]}..." if auth_header else "No auth header")
+    # Log the authentication details; the masked header is only built for DEBUG
+    logger.info("Submitting prediction with user_id: %s", user_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        auth_header = request.headers.get('Authorization', None)
+        logger.debug("Auth header: %s", f"{auth_header[:15]}..." if auth_header else None)
     
     try:
         data = request.get_json()
@@ -98,108 +99,111 @@ def submit_prediction():
             return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
                 
         # Get contest information
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
                 
-        try:
-            # Check if contest exists and is open
-            cursor.execute(
-                """
-                SELECT status, end_date
-                FROM weekly_contests
-                WHERE id = %s
-                """,
-                (data["contest_id"],)
-            )
+            try:
+                # Check if contest exists and is open
+                cursor.execute(
+                    """
+                    SELECT status, end_date
+                    FROM weekly_contests
+                    WHERE id = %s
+                    """,
+                    (data["contest_id"],)
+                )
             
-            contest = cursor.fetchone()
-            if not contest:
-                return jsonify({"error": "Contest not found"}), 404
+                contest = cursor.fetchone()
+                if not contest:
+                    return jsonify({"error": "Contest not found"}), 404
                 
-            contest_status, contest_end_date = contest
+                contest_status, contest_end_date = contest
             
-            # Check if contest is open
-            if contest_status != "open":
-                return jsonify({"error": "Contest is no longer open for predictions"}), 400
+                # Check if contest is open
+                if contest_status != "open":
+                    return jsonify({"error": "Contest is no longer open for predictions"}), 400
                 
-            # Check if current time is before contest end date
-            if datetime.utcnow() > contest_end_date:
-                return jsonify({"error": "Contest has ended"}), 400
+                # Check if current time is before contest end date
+                if datetime.utcnow() > contest_end_date:
+                    return jsonify({"error": "Contest has ended"}), 400
                 
-            # Check prediction limit per user for this contest
-            cursor.execute(
-                """
-                SELECT COUNT(*)
-                FROM predictions
-                WHERE user_id = %s AND contest_id = %s
-                """,
-                (user_id, data["contest_id"])
-            )
+                # Check prediction limit per user for this contest. Only whether
+                # the limit is reached matters, so stop counting once it is.
+                cursor.execute(
+                    """
+                    SELECT COUNT(*)
+                    FROM (
+                        SELECT 1
+                        FROM predictions
+                        WHERE user_id = %s AND contest_id = %s
+                        LIMIT %s
+                    ) p
+                    """,
+                    (user_id, data["contest_id"], MAX_PREDICTIONS_PER_CONTEST)
+                )
             
-            prediction_count = cursor.fetchone()[0]
+                prediction_count = cursor.fetchone()[0]
             
-            # Limit to 10 predictions per contest
-            if prediction_count >= 10:
-                return jsonify({"error": "Maximum prediction limit reached for this contest (10)"}), 400
+                if prediction_count >= MAX_PREDICTIONS_PER_CONTEST:
+                    return jsonify({"error": f"Maximum prediction limit reached for this contest ({MAX_PREDICTIONS_PER_CONTEST})"}), 400
                 
-            # Validate chart_type (normalize by removing trailing slash)
-            chart_id = data["chart_type"].rstrip('/')
-            if chart_id not in ["hot-100", "billboard-200"]:
-                return jsonify({"error": "Invalid chart type. Must be 'hot-100' or 'billboard-200'"}), 400
+                # Validate chart_type (normalize by removing trailing slash)
+                chart_id = data["chart_type"].rstrip('/')
+                if chart_id not in ["hot-100", "billboard-200"]:
+                    return jsonify({"error": "Invalid chart type. Must be 'hot-100' or 'billboard-200'"}), 400
                 
-            # Validate prediction_type
-            if data["prediction_type"] not in ["entry", "exit", "position_change"]:
-                return jsonify({"error": "Invalid prediction type. Must be 'entry', 'exit', or 'position_change'"}), 400
+                # Validate prediction_type
+                if data["prediction_type"] not in ["entry", "exit", "position_change"]:
+                    return jsonify({"error": "Invalid prediction type. Must be 'entry', 'exit', or 'position_change'"}), 400
                 
-            # Insert the prediction
-            cursor.execute(
-                """
-                INSERT INTO predictions (
-                    user_id, contest_id, chart_id, chart_date, prediction_type, 
-                    song_name, artist_name, predicted_position, predicted_change, processed, created_at
+                # Insert the prediction. chart_date and created_at are the
+                # server's current UTC date and time, stored naive as before.
+                cursor.execute(
+                    """
+                    INSERT INTO predictions (
+                        user_id, contest_id, chart_id, chart_date, prediction_type, 
+                        song_name, artist_name, predicted_position, predicted_change, processed, created_at
+                    )
+                    VALUES (%s, %s, %s, (now() AT TIME ZONE 'UTC')::date, %s, %s, %s, %s, %s, %s,
+                            now() AT TIME ZONE 'UTC')
+                    RETURNING id
+                    """,
+                    (
+                        user_id,
+                        data["contest_id"],
+                        chart_id,
+                        data["prediction_type"],
+                        data["target_name"],
+                        data.get("artist", ""),
+                        data["position"] if data["prediction_type"] == "entry" else None,
+                        data["position"] if data["prediction_type"] == "position_change" else None,
+                        False  # Newly inserted predictions aren't processed yet
+                    )
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-                """,
-                (
-                    user_id,
-                    data["contest_id"],
-                    chart_id,
-                    datetime.utcnow().date(),  # Current date for chart_date
-                    data["prediction_type"],
-                    data["target_name"],
-                    data.get("artist", ""),
-                    data["position"] if data["prediction_type"] == "entry" else None,
-                    data["position"] if data["prediction_type"] == "position_change" else None,
-                    False,  # Newly inserted predictions aren't processed yet
-                    datetime.utcnow()
-                )
-            )
             
-            prediction_id = cursor.fetchone()[0]
-            conn.commit()
+                prediction_id = cursor.fetchone()[0]
+                conn.commit()
             
-            return jsonify({
-                "message": "Prediction submitted successfully",
-                "prediction_id": prediction_id
-            }), 201
+                return jsonify({
+                    "message": "Prediction submitted successfully",
+                    "prediction_id": prediction_id
+                }), 201
             
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database error during prediction submission: {e}")
-            return jsonify({"error": f"Failed to submit prediction: {str(e)}"}), 500
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as e:
+                conn.rollback()
+                logger.error("Database error during prediction submission: %s", e)
+                return jsonify({"error": f"Failed to submit prediction: {str(e)}"}), 500
+            finally:
+                cursor.close()
             
     except Exception as e:
-        logger.error(f"Error submitting prediction: {e}")
+        logger.error("Error submitting prediction: %s", e)
         return jsonify({"error": "Failed to process prediction"}), 500
 
 # GET /api/predictions/user - Get user's predictions
 @predictions_bp.route("/predictions/user", methods=["GET"])
 @jwt_required()
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_user_predictions():
     """Get predictions made by the authenticated user"""
     user_id = get_jwt_identity()
@@ -209,89 +213,84 @@ def get_user_predictions():
         contest_id = request.args.get("contest_id")
         chart_type = request.args.get("chart_type")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Build the query based on parameters
-            query = """
-                SELECT p.id, p.contest_id, p.chart_id AS chart_type, p.prediction_type, 
-                       p.song_name AS target_name, p.artist_name AS artist, 
-                       CASE 
-                         WHEN p.prediction_type = 'entry' THEN p.predicted_position
-                         WHEN p.prediction_type = 'position_change' THEN p.predicted_change
-                         ELSE NULL
-                       END AS position, 
-                       p.created_at AS prediction_date, pr.is_correct, pr.points_earned as points, 
-                       pr.processed_at as result_date,
-                       wc.chart_release_date, wc.status
-                FROM predictions p
-                LEFT JOIN prediction_results pr ON p.id = pr.prediction_id
-                LEFT JOIN weekly_contests wc ON p.contest_id = wc.id
-                WHERE p.user_id = %s
-            """
-            params = [user_id]
+        with db_cursor() as cursor:
+            try:
+                # Build the query based on parameters
+                query = """
+                    SELECT p.id, p.contest_id, p.chart_id AS chart_type, p.prediction_type, 
+                           p.song_name AS target_name, p.artist_name AS artist, 
+                           CASE 
+                             WHEN p.prediction_type = 'entry' THEN p.predicted_position
+                             WHEN p.prediction_type = 'position_change' THEN p.predicted_change
+                             ELSE NULL
+                           END AS position, 
+                           p.created_at AS prediction_date, pr.is_correct, pr.points_earned as points, 
+                           pr.processed_at as result_date,
+                           wc.chart_release_date, wc.status
+                    FROM predictions p
+                    LEFT JOIN prediction_results pr ON p.id = pr.prediction_id
+                    LEFT JOIN weekly_contests wc ON p.contest_id = wc.id
+                    WHERE p.user_id = %s
+                """
+                params = [user_id]
             
-            if contest_id:
-                query += " AND p.contest_id = %s"
-                params.append(contest_id)
+                if contest_id:
+                    query += " AND p.contest_id = %s"
+                    params.append(contest_id)
                 
-            if chart_type:
-                query += " AND p.chart_id = %s"
-                params.append(chart_type.rstrip('/'))  # Normalize chart type
+                if chart_type:
+                    query += " AND p.chart_id = %s"
+                    params.append(chart_type.rstrip('/'))  # Normalize chart type
                 
-            query += " ORDER BY p.created_at DESC"
+                query += " ORDER BY p.created_at DESC"
             
-            # Add debug logging
-            logger.info(f"Executing query for user_id {user_id} with params: {params}")
-            logger.debug(f"SQL Query: {query}")
+                # Add debug logging
+                logger.debug("Executing query for user_id %s with params: %s", user_id, params)
+                logger.debug("SQL Query: %s", query)
             
-            cursor.execute(query, params)
-            predictions = cursor.fetchall()
+                cursor.execute(query, params)
+                predictions = cursor.fetchall()
             
-            # Add debug logging for result count
-            logger.info(f"Retrieved {len(predictions)} predictions for user {user_id}")
+                # Add debug logging for result count
+                logger.debug("Retrieved %s predictions for user %s", len(predictions), user_id)
             
-            result = []
-            for prediction in predictions:
-                # Add debug logging if any prediction processing fails
-                try:
-                    result.append({
-                        "id": prediction[0],
-                        "contest_id": prediction[1],
-                        "chart_type": prediction[2],
-                        "prediction_type": prediction[3],
-                        "target_name": prediction[4],
-                        "artist": prediction[5],
-                        "position": prediction[6],
-                        "prediction_date": prediction[7].isoformat() if prediction[7] else None,
-                        "is_correct": prediction[8],
-                        "points": prediction[9],
-                        "result_date": prediction[10].isoformat() if prediction[10] else None,
-                        "chart_release_date": prediction[11].isoformat() if prediction[11] else None,
-                        "contest_status": prediction[12]
-                    })
-                except Exception as row_err:
-                    logger.error(f"Error processing prediction row: {row_err}")
-                    logger.error(f"Problem row data: {prediction}")
-                    # Continue processing other rows
+                result = []
+                for prediction in predictions:
+                    # Add debug logging if any prediction processing fails
+                    try:
+                        result.append({
+                            "id": prediction[0],
+                            "contest_id": prediction[1],
+                            "chart_type": prediction[2],
+                            "prediction_type": prediction[3],
+                            "target_name": prediction[4],
+                            "artist": prediction[5],
+                            "position": prediction[6],
+                            "prediction_date": prediction[7],
+                            "is_correct": prediction[8],
+                            "points": prediction[9],
+                            "result_date": prediction[10],
+                            "chart_release_date": prediction[11],
+                            "contest_status": prediction[12]
+                        })
+                    except Exception as row_err:
+                        logger.error("Error processing prediction row: %s", row_err)
+                        logger.error("Problem row data: %s", prediction)
+                        # Continue processing other rows
                 
-            return jsonify({"predictions": result}), 200
+                return json_response({"predictions": result}), 200
             
-        except Exception as db_err:
-            logger.error(f"Database error in get_user_predictions: {db_err}")
-            return jsonify({"error": "Database error", "details": str(db_err)}), 500
-        finally:
-            cursor.close()
-            conn.close()
+            except Exception as db_err:
+                logger.error("Database error in get_user_predictions: %s", db_err)
+                return jsonify({"error": "Database error", "details": str(db_err)}), 500
             
     except Exception as e:
-        logger.error(f"Unexpected error in get_user_predictions: {e}")
+        logger.error("Unexpected error in get_user_predictions: %s", e)
         return jsonify({"error": "Failed to retrieve predictions", "details": str(e)}), 500
 
 # GET /api/predictions/leaderboard - Get global leaderboard
 @predictions_bp.route("/predictions/leaderboard", methods=["GET"])
-@limiter.limit("30 per minute", key_func=get_real_ip)
+@limiter.limit("30 per minute")
 def get_leaderboard():
     """Get the prediction leaderboard"""
     try:
@@ -300,61 +299,71 @@ def get_leaderboard():
         limit = request.args.get("limit", 50, type=int)
         period = request.args.get("period", "all")  # 'all', 'weekly'
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        weekly = period == "weekly" and contest_id
+        cache_key = ("weekly", contest_id, limit) if weekly else ("all", None, limit)
+        with _leaderboard_cache_lock:
+            cached = _leaderboard_cache.get(cache_key)
+        if cached is not None:
+            return _leaderboard_response(cached), 200
         
-        try:
-            if period == "weekly" and contest_id:
+        with db_cursor() as cursor:
+            if weekly:
                 # Get leaderboard for a specific contest
-                query = """
+                ranking = """
                     SELECT u.id, u.username, COUNT(p.id) as predictions_made,
                            SUM(CASE WHEN pr.is_correct = TRUE THEN 1 ELSE 0 END) as correct_predictions,
-                           SUM(COALESCE(pr.points_earned, 0)) as total_points
+                           SUM(COALESCE(pr.points_earned, 0)) as total_points,
+                           row_number() OVER (
+                               ORDER BY SUM(COALESCE(pr.points_earned, 0)) DESC,
+                                        SUM(CASE WHEN pr.is_correct = TRUE THEN 1 ELSE 0 END) DESC
+                           ) as rank
                     FROM users u
                     JOIN predictions p ON u.id = p.user_id
                     JOIN prediction_results pr ON p.id = pr.prediction_id
                     WHERE p.contest_id = %s AND p.processed = TRUE
                     GROUP BY u.id, u.username
-                    ORDER BY total_points DESC, correct_predictions DESC
+                    ORDER BY rank
                     LIMIT %s
                 """
                 params = [contest_id, limit]
             else:
                 # Get all-time leaderboard
-                query = """
-                    SELECT id, username, predictions_made, correct_predictions, total_points
+                ranking = """
+                    SELECT id, username, predictions_made, correct_predictions, total_points,
+                           row_number() OVER (ORDER BY total_points DESC, correct_predictions DESC) as rank
                     FROM users
                     WHERE predictions_made > 0
-                    ORDER BY total_points DESC, correct_predictions DESC
+                    ORDER BY rank
                     LIMIT %s
                 """
                 params = [limit]
-                
-            cursor.execute(query, params)
-            users = cursor.fetchall()
             
-            result = []
-            for i, user in enumerate(users, 1):
-                predictions_made = user[2] or 0
-                correct_predictions = user[3] or 0
-                accuracy = round((correct_predictions / predictions_made * 100), 1) if predictions_made > 0 else 0
-                
-                result.append({
-                    "rank": i,
-                    "user_id": user[0],
-                    "username": user[1],
-                    "predictions_made": predictions_made,
-                    "correct_predictions": correct_predictions,
-                    "total_points": user[4] or 0,
-                    "accuracy": accuracy
-                })
-                
-            return jsonify({"leaderboard": result}), 200
+            # Postgres builds the whole response body, including accuracy
+            # as a percentage to one decimal place, so it is sent as is
+            query = """
+                SELECT json_build_object(
+                    'leaderboard', COALESCE(json_agg(json_build_object(
+                        'rank', rank,
+                        'user_id', id,
+                        'username', username,
+                        'predictions_made', COALESCE(predictions_made, 0),
+                        'correct_predictions', COALESCE(correct_predictions, 0),
+                        'total_points', COALESCE(total_points, 0),
+                        'accuracy', CASE WHEN predictions_made > 0
+                            THEN round(COALESCE(correct_predictions, 0) * 100.0 / predictions_made, 1)
+                            ELSE 0 END
+                    ) ORDER BY rank), '[]'::json)
+                )::text
+                FROM (""" + ranking + """) ranked
+            """
             
-        finally:
-            cursor.close()
-            conn.close()
+            cursor.execute(query, params)
+            body = cursor.fetchone()[0].encode("utf-8")
             
+            with _leaderboard_cache_lock:
+                _leaderboard_cache[cache_key] = body
+            return _leaderboard_response(body), 200
+
     except Exception as e:
-        logger.error(f"Error getting leaderboard: {e}")
+        logger.error("Error getting leaderboard: %s", e)
         return jsonify({"error": "Failed to retrieve leaderboard"}), 500
\ No newline at end of file